@@ -0,0 +1,314 @@
+import argparse
+import contextlib
+import cProfile
+import gc
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+# Per-request CPU cost of the cloud and bulb Flask apps, driven through their test clients:
+# no sockets, and the cloud's bulb upstream is simulate.StandIn mounted on each device session.
+# Import side effects of both apps are pinned before they are imported.
+# Throughput only compares on one machine, so no baseline is shipped: record one there first
+# (python bench.py --out baseline.json) and check later runs with --baseline baseline.json.
+os.environ["DEVICES"] = "default=http://bulb.bench"
+os.environ.pop("DEVICES_FILE", None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Cloud"))
+
+import bulb
+import cloud_server
+import scenario
+from loadgen import percentile
+from simulate import StandIn
+
+API_KEY = "bench-key"
+DEVICE = "default"
+
+
+class Case:
+    # One route + payload shape. request(i) -> keyword arguments for test_client().open() of the i-th call.
+    def __init__(self, app, name: str, path: str, method: str = "GET", expect: int = 200,
+                 request: Optional[Callable[[int], Dict[str, Any]]] = None, setup: Optional[Callable[[], None]] = None,
+                 teardown: Optional[Callable[[], None]] = None):
+        self.app = app
+        self.name = name
+        self.path = path
+        self.method = method
+        self.expect = expect
+        self.request = request or (lambda i: {})
+        self.setup = setup
+        self.teardown = teardown
+
+
+def cloud_headers(extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    return dict({"X-API-Key": API_KEY}, **(extra or {}))
+
+
+def cache_ttl(seconds: float) -> Callable[[], None]:
+    def setup() -> None:
+        cloud_server.status_cache.ttl = seconds
+        cloud_server.status_cache.invalidate(DEVICE)
+    return setup
+
+
+def primed_cache() -> None:
+    cache_ttl(3600)()
+    cloud_server.app.test_client().get("/cloud", headers=cloud_headers())
+
+
+def cloud_etag() -> str:
+    return cloud_server.status_cache.peek(DEVICE)[1] or '"none"'
+
+
+def bulb_etag() -> str:
+    return bulb.bulb.etag()
+
+
+history_since = 0.0
+history_dir: Optional[tempfile.TemporaryDirectory] = None
+
+def open_journal() -> None:
+    # a throwaway journal for the /history case only, removed again by close_journal
+    global history_since, history_dir
+    history_dir = tempfile.TemporaryDirectory(prefix="bench-")
+    if bulb.enable_journal(os.path.join(history_dir.name, "journal.bin")) is None:
+        close_journal()
+        raise RuntimeError(f"cannot open a journal in {tempfile.gettempdir()}")
+    # the query always spans these 1000 records
+    history_since = time.time()
+    for k in range(1000):
+        bulb.journal.append("brightness", True, k % 101, "#FFFFFF", k, "http", f"bench-{k}")
+
+
+def close_journal() -> None:
+    global history_dir
+    if bulb.journal is not None:
+        bulb.journal.close()
+    bulb.journal = bulb.bulb.journal = None
+    history_dir.cleanup()
+    history_dir = None
+
+
+EFFECT = {"mode": "fade", "loop": 2, "keyframes": [{"color": "#FF0040", "duration": 0.5}] * 8}
+
+CASES = [
+    Case(cloud_server.app, "cloud GET /cloud hit", "/cloud", setup=cache_ttl(3600),
+         request=lambda i: {"headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud GET /cloud 304", "/cloud", expect=304, setup=primed_cache,
+         request=lambda i: {"headers": cloud_headers({"If-None-Match": cloud_etag()})}),
+    Case(cloud_server.app, "cloud GET /cloud miss", "/cloud", setup=cache_ttl(0),
+         request=lambda i: {"headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud GET /cloud no key", "/cloud", expect=401),
+    Case(cloud_server.app, "cloud PATCH color", "/cloud", "PATCH", setup=cache_ttl(3600),
+         request=lambda i: {"json": {"color": f"#{i % 0xFFFFFF:06X}"}, "headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud PATCH full", "/cloud", "PATCH",
+         request=lambda i: {"json": {"enabled": bool(i % 2), "brightness": i % 101, "color": f"#{i % 0xFFFFFF:06x}"},
+                            "headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud PATCH strings", "/cloud", "PATCH",
+         request=lambda i: {"json": {"enabled": "on" if i % 2 else "off", "brightness": str(i % 101)},
+                            "headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud PATCH effect", "/cloud", "PATCH",
+         request=lambda i: {"json": {"effect": EFFECT}, "headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud PATCH invalid", "/cloud", "PATCH", expect=400,
+         request=lambda i: {"json": {"brightness": 101}, "headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud PATCH idempotency miss", "/cloud", "PATCH",
+         request=lambda i: {"json": {"brightness": i % 101},
+                            "headers": cloud_headers({"Idempotency-Key": f"bench-{time.perf_counter_ns()}"})}),
+    Case(cloud_server.app, "cloud PATCH idempotency hit", "/cloud", "PATCH",
+         request=lambda i: {"json": {"brightness": 50}, "headers": cloud_headers({"Idempotency-Key": "bench-replay"})}),
+    Case(cloud_server.app, "cloud GET /devices", "/devices", request=lambda i: {"headers": cloud_headers()}),
+    Case(cloud_server.app, "cloud GET /metrics", "/metrics", request=lambda i: {"headers": cloud_headers()}),
+    Case(bulb.app, "bulb GET /status", "/status"),
+    Case(bulb.app, "bulb GET /status 304", "/status", expect=304,
+         request=lambda i: {"headers": {"If-None-Match": bulb_etag()}}),
+    Case(bulb.app, "bulb POST /state", "/state", "POST",
+         request=lambda i: {"json": {"enabled": True, "brightness": i % 101, "color": f"#{i % 0xFFFFFF:06X}"}}),
+    Case(bulb.app, "bulb POST /state 412", "/state", "POST", expect=412,
+         request=lambda i: {"json": {"brightness": 10}, "headers": {"If-Match": '"stale-0"'}}),
+    Case(bulb.app, "bulb POST /color", "/color", "POST", request=lambda i: {"json": {"color": f"#{i % 0xFFFFFF:06X}"}}),
+    Case(bulb.app, "bulb POST /brightness", "/brightness", "POST", request=lambda i: {"json": {"level": i % 101}}),
+    Case(bulb.app, "bulb GET /history", "/history", setup=open_journal, teardown=close_journal,
+         request=lambda i: {"query_string": {"since": history_since, "limit": 100}}),
+    Case(bulb.app, "bulb GET /metrics", "/metrics"),
+]
+
+
+class StackSampler:
+    # Samples one thread's Python stack every `interval` seconds and writes them in the folded
+    # format ("root;caller;callee count") read by flamegraph.pl, inferno and speedscope.
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._switch_interval = sys.getswitchinterval()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def __enter__(self) -> "StackSampler":
+        # the sampler needs the GIL to look: hand it over at least as often as we want samples
+        sys.setswitchinterval(min(self._switch_interval, self.interval))
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def measure(case: Case, seconds: float, min_ops: int, warmup: int) -> Dict[str, Any]:
+    if case.setup:
+        case.setup()
+    try:
+        return _measure(case, seconds, min_ops, warmup)
+    finally:
+        if case.teardown:
+            case.teardown()
+
+
+def _measure(case: Case, seconds: float, min_ops: int, warmup: int) -> Dict[str, Any]:
+    client = case.app.test_client()
+    for i in range(warmup):
+        resp = client.open(case.path, method=case.method, **case.request(i))
+        if resp.status_code != case.expect:
+            raise RuntimeError(f"{case.name}: expected {case.expect}, got {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+    gc.collect()
+    samples: List[float] = []
+    started = time.perf_counter()
+    deadline = started + seconds
+    i = warmup
+    while time.perf_counter() < deadline or len(samples) < min_ops:
+        kwargs = case.request(i)
+        t = time.perf_counter()
+        client.open(case.path, method=case.method, **kwargs)
+        samples.append(time.perf_counter() - t)
+        i += 1
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    us = [s * 1e6 for s in samples]
+    return {
+        "case": case.name,
+        "ops": len(samples),
+        "ops_per_s": round(len(samples) / elapsed, 1),
+        "mean_us": round(sum(us) / len(us), 1),
+        "p50_us": round(percentile(us, 50), 1),
+        "p95_us": round(percentile(us, 95), 1),
+        "p99_us": round(percentile(us, 99), 1),
+        "max_us": round(us[-1], 1),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    # Adds "delta" to each result; returns the cases whose throughput fell by more than threshold.
+    previous = {row["case"]: row for row in baseline.get("cases", [])}
+    regressions = []
+    for row in results:
+        before = previous.get(row["case"])
+        if not before or not before.get("ops_per_s"):
+            row["delta"] = None
+            continue
+        row["delta"] = round(row["ops_per_s"] / before["ops_per_s"] - 1, 4)
+        if row["delta"] < -threshold:
+            regressions.append(row["case"])
+    return regressions
+
+
+def setup_apps() -> None:
+    cloud_server.API_KEY = API_KEY
+    stand_in = StandIn(scenario.VirtualClock())
+    # nothing to keep: the log would otherwise grow by one entry per upstream call
+    stand_in.record = lambda operation: None
+    for device in cloud_server.devices.values():
+        device.session.mount("http://bulb.bench", stand_in)
+        device.session.trust_env = False
+    # request logging would be measured too
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    logging.getLogger("cloud_server").setLevel(logging.ERROR)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="In-process micro-benchmarks of the cloud and bulb request paths.")
+    parser.add_argument("--seconds", type=float, default=1.0, help="measuring time per case")
+    parser.add_argument("--min-ops", type=int, default=200, help="at least this many calls per case")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--filter", default=None, help="only cases whose name matches this regex")
+    parser.add_argument("--out", default=None, help="write the results as JSON (usable as a baseline)")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier --out run on this machine to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fail when a case's ops/s drops by more than this fraction of the baseline (default 0.2)")
+    parser.add_argument("--cprofile", default=None, help="run under cProfile and dump pstats to this file")
+    parser.add_argument("--flamegraph", default=None, help="sample stacks and write them in folded format to this file")
+    parser.add_argument("--sample-interval", type=float, default=0.001, help="stack sampling period in seconds")
+    args = parser.parse_args(argv)
+
+    setup_apps()
+    cases = [c for c in CASES if not args.filter or re.search(args.filter, c.name)]
+    if not cases:
+        raise SystemExit(f"no case matches '{args.filter}'")
+
+    profiler = cProfile.Profile() if args.cprofile else None
+    sampler = StackSampler(threading.get_ident(), args.sample_interval) if args.flamegraph else None
+    results = []
+    with contextlib.ExitStack() as stack:
+        if sampler:
+            stack.enter_context(sampler)
+        if profiler:
+            stack.enter_context(profiler)
+        for case in cases:
+            results.append(measure(case, args.seconds, args.min_ops, args.warmup))
+
+    regressions: List[str] = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    print(f"{'case':<32}{'ops/s':>10}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}{'vs base':>10}")
+    for row in results:
+        delta = row.get("delta")
+        shown = f"{delta * 100:+.1f}%" if delta is not None else "-"
+        print(f"{row['case']:<32}{row['ops_per_s']:>10.0f}{row['p50_us']:>10.1f}{row['p95_us']:>10.1f}"
+              f"{row['p99_us']:>10.1f}{shown:>10}")
+    if profiler:
+        profiler.dump_stats(args.cprofile)
+        print(f"[BENCH] cProfile stats written to {args.cprofile} (python -m pstats {args.cprofile})")
+    if sampler:
+        sampler.write(args.flamegraph)
+        print(f"[BENCH] folded stacks written to {args.flamegraph} (flamegraph.pl or speedscope)")
+    if args.out:
+        meta = {"python": platform.python_version(), "machine": platform.machine(), "seconds": args.seconds,
+                "profiled": bool(profiler or sampler), "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(args.out, "w") as f:
+            json.dump({"meta": meta, "cases": results}, f, indent=2)
+        print(f"[BENCH] results written to {args.out}")
+    if regressions:
+        print(f"[BENCH] {len(regressions)} case(s) slower than the baseline by more than "
+              f"{args.threshold * 100:g}%: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,450 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
+from werkzeug.http import parse_etags, unquote_etag
 import urllib3
+import hashlib
+import os
 import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from journal import open_journal
+from metrics import CONTENT_TYPE, Registry, SpanRecorder
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+HEX_COLOR_RE = re.compile(r"^#[0-9A-Fa-f]{6}$")
+
+# journal des changements d'état, ouvert par main.py seulement (enable_journal) : importer ce module
+# (bench, loadgen --local, simulate) ne lit ni n'écrit rien sur disque.
+# JOURNAL_PATH vide = pas de journal (ni de restauration au démarrage)
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "/tmp/bulb_journal.bin")
+JOURNAL_RECORDS = int(os.getenv("JOURNAL_RECORDS", "65536"))
+HISTORY_MAX_LIMIT = 10000
+
+# origine du changement en cours, (source, X-Request-Id) : "http" pendant une requête, "effect" dans le thread d'effet
+change_source: ContextVar = ContextVar("change_source", default=("local", None))
+
+class PreconditionFailed(Exception):
+    pass
+
 class SmartBulb:
     def __init__(self):
         self.is_on = False
         self.brightness = 100  # 0-100
         self.color = "#FFFFFF"  # couleur par défaut : blanc
+        # Flask tourne dans un thread à côté du scénario (main.py)
+        self.lock = threading.RLock()
+        # version incrémentée à chaque changement réel ; l'epoch distingue les redémarrages
+        self.version = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self.journal = None
+        # dernier champ changé par un effet et pas encore journalisé
+        self._unjournaled = None
+
+    def _set(self, attr, value):
+        # à appeler avec self.lock tenu
+        if getattr(self, attr) != value:
+            setattr(self, attr, value)
+            self.version += 1
+            if self.journal is None:
+                return
+            source, request_id = change_source.get()
+            if source == "effect":
+                # un fondu change l'état toutes les 50 ms : il viderait l'anneau en moins d'une heure.
+                # Seuls le début et la fin d'un effet sont journalisés (journal_effect)
+                self._unjournaled = attr
+                return
+            self._unjournaled = None
+            self.journal.append(attr, self.is_on, self.brightness, self.color, self.version, source, request_id)
+
+    def journal_effect(self):
+        # un enregistrement pour l'état atteint par l'effet depuis le dernier, s'il a changé quelque chose
+        with self.lock:
+            if self.journal is not None and self._unjournaled is not None:
+                self.journal.append(self._unjournaled, self.is_on, self.brightness, self.color, self.version, "effect")
+                self._unjournaled = None
+
+    def restore(self, journal):
+        # le dernier enregistrement porte l'état complet : restauration en temps constant
+        with self.lock:
+            self.journal = journal
+            last = journal.last()
+            if last:
+                self.is_on = last["state"]["is_on"]
+                self.brightness = last["state"]["brightness"]
+                self.color = last["state"]["color"]
+                self.version = last["version"]
+            return last
 
     def turn_on(self):
-        self.is_on = True
+        with self.lock:
+            self._set("is_on", True)
 
     def turn_off(self):
-        self.is_on = False
+        with self.lock:
+            self._set("is_on", False)
 
     def set_brightness(self, value):
-        self.brightness = max(0, min(100, value))
+        with self.lock:
+            self._set("brightness", max(0, min(100, value)))
 
     def set_color(self, hex_color):
         # validation rapide du format #RRGGBB
-        if isinstance(hex_color, str) and re.fullmatch(r"^#[0-9A-Fa-f]{6}$", hex_color):
-            self.color = hex_color.upper()
+        if isinstance(hex_color, str) and HEX_COLOR_RE.fullmatch(hex_color):
+            with self.lock:
+                self._set("color", hex_color.upper())
         else:
             raise ValueError("Invalid color format, expected '#RRGGBB'")
 
+    def etag(self):
+        with self.lock:
+            return f'"{self.epoch}-{self.version}"'
+
+    def digest(self):
+        # empreinte de l'état visible, recalculée à l'identique côté cloud (state_digest)
+        with self.lock:
+            raw = f"{self.is_on}|{self.brightness}|{self.color}"
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+    def apply_state(self, enabled=None, brightness=None, color=None, if_match=None, before_write=None):
+        # tout est validé avant de toucher à l'état : pas de mise à jour partielle.
+        # before_write est appelé sous le verrou une fois l'écriture acceptée (effects.interrupt)
+        if enabled is not None and not isinstance(enabled, bool):
+            raise ValueError("'enabled' must be boolean")
+        if brightness is not None:
+            if isinstance(brightness, bool) or not isinstance(brightness, int):
+                raise ValueError("'brightness' must be integer")
+        if color is not None and not (isinstance(color, str) and HEX_COLOR_RE.fullmatch(color)):
+            raise ValueError("Invalid color format, expected '#RRGGBB'")
+
+        with self.lock:
+            # If-Match : liste d'ETags ou "*", comparaison forte (un W/ ne correspond jamais)
+            if if_match is not None and not parse_etags(if_match).contains(unquote_etag(self.etag())[0]):
+                raise PreconditionFailed(f"State changed, current ETag is {self.etag()}")
+            if before_write is not None:
+                before_write()
+            if enabled is not None:
+                self._set("is_on", enabled)
+            if brightness is not None:
+                self._set("brightness", max(0, min(100, brightness)))
+            if color is not None:
+                self._set("color", color.upper())
+            return self.status()
+
     def status(self):
-        return {
-            "is_on": self.is_on,
-            "enabled": self.is_on,
-            "brightness": self.brightness,
-            "color": self.color
-        }
+        with self.lock:
+            return {
+                "is_on": self.is_on,
+                "enabled": self.is_on,
+                "brightness": self.brightness,
+                "color": self.color,
+                "version": self.version,
+            }
+
+EFFECT_TICK_SECONDS = 0.05
+EFFECT_MAX_KEYFRAMES = 64
+EFFECT_MAX_DURATION = 60.0
+EFFECT_MAX_LOOPS = 1000
+
+def _hex_to_rgb(hex_color):
+    return tuple(int(hex_color[i:i + 2], 16) for i in (1, 3, 5))
+
+def _rgb_to_hex(rgb):
+    return "#{:02X}{:02X}{:02X}".format(*(max(0, min(255, round(c))) for c in rgb))
+
+def parse_effect(data):
+    # {"keyframes": [{"color": "#RRGGBB", "brightness": 0-100, "duration": s}, ...], "loop": n (0 = infini), "mode": "step"|"fade"}
+    if not isinstance(data, dict):
+        raise ValueError("effect must be an object")
+    keyframes = data.get("keyframes")
+    if not isinstance(keyframes, list) or not keyframes:
+        raise ValueError("'keyframes' must be a non-empty list")
+    if len(keyframes) > EFFECT_MAX_KEYFRAMES:
+        raise ValueError(f"at most {EFFECT_MAX_KEYFRAMES} keyframes")
+    mode = data.get("mode", "step")
+    if mode not in ("step", "fade"):
+        raise ValueError("'mode' must be 'step' or 'fade'")
+    loop = data.get("loop", 1)
+    if isinstance(loop, bool) or not isinstance(loop, int) or not (0 <= loop <= EFFECT_MAX_LOOPS):
+        raise ValueError(f"'loop' must be an integer between 0 and {EFFECT_MAX_LOOPS}")
+
+    frames = []
+    for kf in keyframes:
+        if not isinstance(kf, dict):
+            raise ValueError("each keyframe must be an object")
+        color = kf.get("color")
+        brightness = kf.get("brightness")
+        duration = kf.get("duration", 1.0)
+        if color is None and brightness is None:
+            raise ValueError("each keyframe needs 'color' and/or 'brightness'")
+        if color is not None and not (isinstance(color, str) and HEX_COLOR_RE.fullmatch(color)):
+            raise ValueError("Invalid color format, expected '#RRGGBB'")
+        if brightness is not None and (isinstance(brightness, bool) or not isinstance(brightness, int)
+                                       or not (0 <= brightness <= 100)):
+            raise ValueError("'brightness' must be an integer between 0 and 100")
+        if isinstance(duration, bool) or not isinstance(duration, (int, float)) or not (0 < duration <= EFFECT_MAX_DURATION):
+            raise ValueError(f"'duration' must be a number in ]0, {EFFECT_MAX_DURATION}]")
+        frames.append({"color": color.upper() if color else None, "brightness": brightness, "duration": float(duration)})
+    return {"keyframes": frames, "loop": loop, "mode": mode}
+
+class EffectPlayer:
+    # Joue un effet localement sur la lampe : un seul thread, un seul effet à la fois.
+    def __init__(self, bulb, tick=EFFECT_TICK_SECONDS):
+        self.bulb = bulb
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.current = None
+        self.started_at = None
+
+    def start(self, effect):
+        with self._lock:
+            self._stop_locked()
+            self._stop = threading.Event()
+            self.current = effect
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, args=(effect, self._stop), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop_locked()
+
+    def _stop_locked(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.current = None
+
+    def interrupt(self):
+        # à appeler sous bulb.lock par une écriture acceptée : l'effet n'écrit plus rien après elle.
+        # Sans attendre le thread, qui attend peut-être ce même verrou
+        self._stop.set()
+        self.bulb.journal_effect()
+
+    def running(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def status(self):
+        with self._lock:
+            effect = self.current if self.running() else None
+            return {
+                "running": effect is not None,
+                "mode": effect["mode"] if effect else None,
+                "keyframes": len(effect["keyframes"]) if effect else 0,
+                "loop": effect["loop"] if effect else None,
+                "started_at": self.started_at if effect else None,
+            }
+
+    def _run(self, effect, stop):
+        change_source.set(("effect", None))
+        self._apply(stop, enabled=True)
+        self.bulb.journal_effect()
+        try:
+            self._play(effect, stop)
+        finally:
+            # stop() attend la fin de ce thread : l'état final est journalisé avant l'écriture qui l'interrompt
+            self.bulb.journal_effect()
+
+    def _apply(self, stop, **fields):
+        # stop vérifié sous le verrou : rien ne passe après un interrupt()
+        with self.bulb.lock:
+            if not stop.is_set():
+                self.bulb.apply_state(**fields)
+
+    def _play(self, effect, stop):
+        loops = effect["loop"]
+        n = 0
+        while not stop.is_set() and (loops == 0 or n < loops):
+            for kf in effect["keyframes"]:
+                if stop.is_set():
+                    return
+                if effect["mode"] == "fade":
+                    self._fade_to(kf, stop)
+                else:
+                    self._apply(stop, brightness=kf["brightness"], color=kf["color"])
+                    stop.wait(kf["duration"])
+            n += 1
+
+    def _fade_to(self, kf, stop):
+        start_state = self.bulb.status()
+        start_rgb = _hex_to_rgb(start_state["color"])
+        end_rgb = _hex_to_rgb(kf["color"]) if kf["color"] else start_rgb
+        start_b = start_state["brightness"]
+        end_b = kf["brightness"] if kf["brightness"] is not None else start_b
+        t0 = time.monotonic()
+        while not stop.is_set():
+            frac = min(1.0, (time.monotonic() - t0) / kf["duration"])
+            rgb = tuple(a + (b - a) * frac for a, b in zip(start_rgb, end_rgb))
+            self._apply(stop, brightness=round(start_b + (end_b - start_b) * frac), color=_rgb_to_hex(rgb))
+            if frac >= 1.0:
+                return
+            stop.wait(self.tick)
 
 bulb = SmartBulb()
+journal = None
+effects = EffectPlayer(bulb)
+
+def enable_journal(path=JOURNAL_PATH, records=JOURNAL_RECORDS):
+    # ouvre le journal, restaure le dernier état enregistré et sert /history à partir de là
+    global journal
+    journal = open_journal(path, records)
+    if journal is not None and bulb.restore(journal):
+        print(f"[JOURNAL] restored {bulb.status()} from {path}")
+    return journal
 app = Flask(__name__)
 
+registry = Registry()
+http_latency = registry.histogram(
+    "bulb_http_request_duration_seconds", "Time spent handling a request", ("method", "route", "status"))
+registry.gauge("bulb_state_version", "State version (bumped on every real change)", lambda: bulb.version)
+registry.gauge("bulb_effect_running", "1 while an effect is playing", lambda: int(effects.running()))
+registry.gauge("bulb_journal_records", "State changes held in the journal", lambda: len(journal) if journal is not None else 0)
+# X-Request-Id envoyé par le cloud : ses spans et les nôtres se recoupent
+spans = SpanRecorder(int(os.getenv("METRICS_SPAN_BUFFER", "1024")))
+registry.gauge("bulb_span_buffer_spans", "Timing spans held for /metrics/spans", lambda: len(spans))
+
+@app.before_request
+def before_request():
+    g.started = time.perf_counter()
+    g.started_wall = time.time()
+    g.source_token = change_source.set(("http", request.headers.get("X-Request-Id")))
+
+@app.teardown_request
+def teardown_request(exc):
+    # le canal de commande rejoue ses requêtes dans son propre thread : ne rien laisser traîner
+    if "source_token" in g:
+        change_source.reset(g.source_token)
+
+@app.after_request
+def after_request(resp):
+    request_id = request.headers.get("X-Request-Id")
+    if request_id:
+        resp.headers["X-Request-Id"] = request_id
+    if "started" in g:
+        elapsed = time.perf_counter() - g.started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_latency.observe(elapsed, request.method, route, resp.status_code)
+        spans.record(request_id, "request", g.started_wall, elapsed,
+                     method=request.method, route=route, status=resp.status_code)
+    return resp
+
+def with_etag(resp, etag):
+    resp.headers["ETag"] = etag
+    return resp
+
 @app.route("/status", methods=["GET"])
 def get_status():
-    return jsonify(bulb.status())
+    with bulb.lock:
+        etag = bulb.etag()
+        # If-None-Match : liste d'ETags (éventuellement W/) ou "*", comparés en entier
+        if request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+            return with_etag(app.response_class(status=304), etag)
+        state = bulb.status()
+    return with_etag(jsonify(state), etag)
 
 @app.route("/on", methods=["POST"])
 def turn_on():
-    bulb.turn_on()
+    with bulb.lock:
+        effects.interrupt()
+        bulb.turn_on()
     return "Bulb turned ON", 200
 
 @app.route("/off", methods=["POST"])
 def turn_off():
-    bulb.turn_off()
+    with bulb.lock:
+        effects.interrupt()
+        bulb.turn_off()
     return "Bulb turned OFF", 200
 
 @app.route("/brightness", methods=["POST"])
 def brightness():
     level = request.json.get("level", 100)
-    bulb.set_brightness(level)
+    with bulb.lock:
+        effects.interrupt()
+        bulb.set_brightness(level)
     return f"Brightness set to {level}", 200
 
 @app.route("/color", methods=["POST"])
 def color():
     data = request.get_json(silent=True) or {}
     hex_color = data.get("color")
-    try:
+    # une couleur invalide laisse l'effet en cours tranquille
+    if not (isinstance(hex_color, str) and HEX_COLOR_RE.fullmatch(hex_color)):
+        return "Invalid color format, expected '#RRGGBB'", 400
+    with bulb.lock:
+        effects.interrupt()
         bulb.set_color(hex_color)
-        return f"Color set to {hex_color.upper()}", 200
-    except Exception as e:
-        return str(e), 400
+    return f"Color set to {hex_color.upper()}", 200
+
+@app.route("/state", methods=["POST"])
+def state():
+    data = request.get_json(silent=True) or {}
+    try:
+        with bulb.lock:
+            new_state = bulb.apply_state(
+                enabled=data.get("enabled"),
+                brightness=data.get("brightness"),
+                color=data.get("color"),
+                if_match=request.headers.get("If-Match"),
+                # une commande explicite acceptée l'emporte sur l'effet en cours ; un 400 ou un 412 n'y touche pas
+                before_write=effects.interrupt,
+            )
+            etag = bulb.etag()
+    except PreconditionFailed as e:
+        return with_etag(jsonify({"error": "precondition_failed", "message": str(e)}), bulb.etag()), 412
+    except ValueError as e:
+        return jsonify({"error": "validation", "message": str(e)}), 400
+    return with_etag(jsonify(new_state), etag), 200
+
+@app.route("/effect", methods=["GET"])
+def effect_status():
+    return jsonify(effects.status())
+
+@app.route("/effect", methods=["POST"])
+def start_effect():
+    try:
+        effect = parse_effect(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": "validation", "message": str(e)}), 400
+    effects.start(effect)
+    return jsonify(effects.status()), 200
+
+@app.route("/effect/stop", methods=["POST"])
+def stop_effect():
+    effects.stop()
+    return jsonify(effects.status()), 200
+
+@app.route("/history", methods=["GET"])
+def history():
+    # ?since=&until= en secondes epoch (until exclu) ; recherche dichotomique dans le journal
+    if journal is None:
+        return jsonify({"error": "journal_disabled", "message": "State journal is disabled (JOURNAL_PATH)"}), 503
+    try:
+        since = float(request.args.get("since", "0"))
+        until = float(request.args["until"]) if "until" in request.args else None
+        limit = max(1, min(int(request.args.get("limit", "1000")), HISTORY_MAX_LIMIT))
+    except ValueError:
+        return jsonify({"error": "validation", "message": "'since'/'until' must be numbers and 'limit' an integer"}), 400
+    records, truncated = journal.range(since, until, limit)
+    return jsonify({"records": records, "truncated": truncated, "held": len(journal)})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route("/metrics/spans", methods=["GET"])
+def metrics_spans():
+    try:
+        limit = max(1, min(int(request.args.get("limit", "100")), 1000))
+    except ValueError:
+        return jsonify({"error": "validation", "message": "'limit' must be an integer"}), 400
+    return jsonify({"spans": spans.query(request.args.get("request_id"), request.args.get("name"), limit)})
 
 if __name__ == "__main__":
     app.run(host="192.168.0.209", port=5000)
@@ -0,0 +1,149 @@
+import os
+import re
+import shlex
+import subprocess
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Deque, List, Optional
+
+# chip-tool does not echo commands in interactive mode; a command is done when
+# its final line shows up on stdout: the success status, or "Run command failure",
+# which chip-tool prints last for every failed command. Anything before that
+# ("CHIP Error" on a retransmission, a non-zero IM status) is progress, not the end:
+# completing on it would fail the wrong command and shift every later result.
+# Overridable for other chip-tool builds.
+OK_RE = re.compile(os.getenv(
+    "CHIPTOOL_OK_RE",
+    r"Status=0x0+\b|status = 0x0+ \(SUCCESS\)",
+))
+FAIL_RE = re.compile(os.getenv("CHIPTOOL_FAIL_RE", r"Run command failure"))
+
+
+class ChipToolError(RuntimeError):
+    pass
+
+
+class ChipToolCommandFailed(ChipToolError):
+    # chip-tool ran the command and the device (or chip-tool) reported an error
+    pass
+
+
+class ChipToolSession:
+    # One long-lived `chip-tool interactive start`. Commands are written as soon as
+    # they are submitted (pipelined) and completed in FIFO order by a reader thread.
+    def __init__(self, chip_tool: str, cwd: Optional[str] = None, timeout: float = 30.0):
+        self.chip_tool = chip_tool
+        self.cwd = cwd
+        self.timeout = timeout
+        self._proc: Optional[subprocess.Popen] = None
+        self._pending: Deque[Future] = deque()
+        self._lock = threading.Lock()
+        self.starts = 0
+
+    def _start_locked(self) -> None:
+        self.starts += 1
+        self._proc = subprocess.Popen(
+            [self.chip_tool, "interactive", "start"],
+            cwd=self.cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        threading.Thread(target=self._read_loop, args=(self._proc,), daemon=True).start()
+
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def submit(self, argv: List[str]) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            if not self.alive():
+                self._start_locked()
+            self._pending.append(fut)
+            try:
+                self._proc.stdin.write(shlex.join(argv) + "\n")
+                self._proc.stdin.flush()
+            except (BrokenPipeError, OSError) as e:
+                self._pending.remove(fut)
+                fut.set_exception(ChipToolError(f"chip-tool stdin closed: {e}"))
+        return fut
+
+    def run(self, argv: List[str], timeout: Optional[float] = None) -> str:
+        fut = self.submit(argv)
+        try:
+            return fut.result(timeout or self.timeout)
+        except FutureTimeout:
+            # a hung chip-tool would block everything queued behind it: start over
+            self.restart(f"command timed out: {shlex.join(argv)}")
+            raise ChipToolError(f"chip-tool command timed out: {shlex.join(argv)}")
+
+    def restart(self, reason: str) -> None:
+        with self._lock:
+            proc, self._proc = self._proc, None
+            self._fail_pending_locked(reason)
+        if proc and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+    def close(self) -> None:
+        self.restart("session closed")
+
+    def _fail_pending_locked(self, reason: str) -> None:
+        while self._pending:
+            fut = self._pending.popleft()
+            if not fut.done():
+                fut.set_exception(ChipToolError(reason))
+
+    def _read_loop(self, proc: subprocess.Popen) -> None:
+        output: List[str] = []
+        for line in proc.stdout:
+            output.append(line)
+            ok = OK_RE.search(line)
+            failed = FAIL_RE.search(line)
+            if not ok and not failed:
+                continue
+            with self._lock:
+                if self._proc is not proc or not self._pending:
+                    output.clear()
+                    continue
+                fut = self._pending.popleft()
+            text = "".join(output)
+            output.clear()
+            if fut.done():
+                continue
+            if failed:
+                fut.set_exception(ChipToolCommandFailed(f"chip-tool reported failure: {line.strip()}"))
+            else:
+                fut.set_result(text)
+        with self._lock:
+            if self._proc is proc:
+                self._proc = None
+                self._fail_pending_locked(f"chip-tool exited with code {proc.wait()}")
+
+
+class ChipToolPool:
+    # Commands for the same node always go to the same session, so they stay ordered.
+    def __init__(self, chip_tool: str, cwd: Optional[str] = None, size: int = 1, timeout: float = 30.0):
+        self.sessions = [ChipToolSession(chip_tool, cwd, timeout) for _ in range(max(1, size))]
+
+    def session_for(self, node_id: str) -> ChipToolSession:
+        return self.sessions[zlib.crc32(str(node_id).encode()) % len(self.sessions)]
+
+    def run(self, argv: List[str], node_id: str, timeout: Optional[float] = None) -> str:
+        return self.session_for(node_id).run(argv, timeout)
+
+    def submit(self, argv: List[str], node_id: str) -> Future:
+        return self.session_for(node_id).submit(argv)
+
+    def close(self) -> None:
+        for session in self.sessions:
+            session.close()
+
+
+def run_oneshot(chip_tool: str, argv: List[str], cwd: Optional[str] = None, timeout: Optional[float] = None) -> None:
+    # Historic behaviour: one chip-tool process (and one CASE session) per command.
+    subprocess.run([chip_tool] + argv, check=True, cwd=cwd, timeout=timeout)
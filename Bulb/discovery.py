@@ -0,0 +1,147 @@
+import json
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# LAN discovery on UDP. Bulbs broadcast an announcement periodically and answer probes
+# with the same message sent back to the prober; controllers keep what they hear in a TTL cache.
+DISCOVERY_PORT = 37020
+ANNOUNCE = "SMARTBULB_DISCOVERY"
+PROBE = "SMARTBULB_PROBE"
+MAX_DATAGRAM = 2048
+
+
+def announcement(device_id: str, port: int, version: int, etag: Optional[str] = None, scheme: str = "http") -> bytes:
+    return json.dumps({
+        "type": ANNOUNCE,
+        "device_id": device_id,
+        "port": port,
+        "scheme": scheme,
+        "version": version,
+        "etag": etag,
+    }, separators=(",", ":")).encode()
+
+
+def probe_message(device_id: Optional[str] = None) -> bytes:
+    return json.dumps({"type": PROBE, "device_id": device_id}, separators=(",", ":")).encode()
+
+
+def decode(data: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        msg = json.loads(data.decode())
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return msg if isinstance(msg, dict) and msg.get("type") in (ANNOUNCE, PROBE) else None
+
+
+def parse_announcement(data: bytes, addr) -> Optional[Dict[str, Any]]:
+    msg = decode(data)
+    if not msg or msg["type"] != ANNOUNCE:
+        return None
+    port = msg.get("port")
+    if not isinstance(msg.get("device_id"), str) or isinstance(port, bool) or not isinstance(port, int):
+        return None
+    scheme = msg.get("scheme") if msg.get("scheme") in ("http", "https") else "http"
+    return {
+        "device_id": msg["device_id"],
+        "host": addr[0],
+        "port": port,
+        "scheme": scheme,
+        "base_url": f"{scheme}://{addr[0]}:{port}",
+        "version": msg.get("version"),
+        "etag": msg.get("etag"),
+    }
+
+
+class DiscoveryCache:
+    # device_id -> last announcement, forgotten after ttl seconds without news
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def put(self, info: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[info["device_id"]] = (time.monotonic() + self.ttl, info)
+
+    def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if not entry:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[device_id]
+                return None
+            return entry[1]
+
+    def forget(self, device_id: str) -> None:
+        with self._lock:
+            self._entries.pop(device_id, None)
+
+    def devices(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [info for exp, info in self._entries.values() if exp > now]
+
+
+def probe(cache: DiscoveryCache, device_id: Optional[str] = None, timeout: float = 0.5,
+          port: int = DISCOVERY_PORT, address: str = "255.255.255.255") -> List[Dict[str, Any]]:
+    # Broadcast a probe and collect the answers; stops at the first match when device_id is given.
+    found: List[Dict[str, Any]] = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.sendto(probe_message(device_id), (address, port))
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, addr = sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                break
+            info = parse_announcement(data, addr)
+            if not info:
+                continue
+            cache.put(info)
+            found.append(info)
+            if device_id and info["device_id"] == device_id:
+                break
+    finally:
+        sock.close()
+    return found
+
+
+class DiscoveryListener:
+    # Passive side: records every announcement broadcast on the LAN.
+    def __init__(self, cache: DiscoveryCache, port: int = DISCOVERY_PORT):
+        self.cache = cache
+        self.port = port
+        self._sock: Optional[socket.socket] = None
+
+    def start(self) -> "DiscoveryListener":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # the bulb's own announcer may share the host and the port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", self.port))
+        self._sock = sock
+        threading.Thread(target=self._run, args=(sock,), daemon=True).start()
+        return self
+
+    def _run(self, sock: socket.socket) -> None:
+        while True:
+            try:
+                data, addr = sock.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                return
+            info = parse_announcement(data, addr)
+            if info:
+                self.cache.put(info)
+
+    def close(self) -> None:
+        if self._sock:
+            self._sock.close()
+            self._sock = None
@@ -0,0 +1,132 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Append-only ring of fixed-size state-change records in a memory-mapped file.
+# Every record carries the field that changed *and* the full state right after the change,
+# so the last record alone is enough to restore the bulb, whatever the size of the file.
+MAGIC = b"BLBJ"
+FORMAT_VERSION = 1
+# magic, format, record size, capacity (records), records ever written
+HEADER = struct.Struct("<4sHHIQ")
+WRITTEN_OFFSET = HEADER.size - 8
+HEADER_SIZE = 64
+# ts, seq, version, color (0xRRGGBB), brightness, is_on, field, source, request id
+RECORD = struct.Struct("<dQIIBBBB36s")
+
+FIELDS = ("is_on", "brightness", "color")
+SOURCES = ("local", "http", "effect")
+
+
+def _value(field: str, is_on: int, brightness: int, color: int) -> Any:
+    if field == "is_on":
+        return bool(is_on)
+    if field == "brightness":
+        return brightness
+    return f"#{color:06X}"
+
+
+class _Timestamps:
+    # ts of the i-th oldest record, read straight from the map (for bisect)
+    def __init__(self, journal: "Journal", n: int):
+        self.journal = journal
+        self.n = n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, i: int) -> float:
+        return struct.unpack_from("<d", self.journal._map, self.journal._offset(i))[0]
+
+
+class Journal:
+    def __init__(self, path: str, capacity: int = 65536):
+        self.path = path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        size = HEADER_SIZE + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != size or not self._header_matches(fd)
+            if fresh:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        if fresh:
+            HEADER.pack_into(self._map, 0, MAGIC, FORMAT_VERSION, RECORD.size, capacity, 0)
+        self.written = HEADER.unpack_from(self._map, 0)[4]
+
+    def _header_matches(self, fd: int) -> bool:
+        header = os.pread(fd, HEADER.size, 0)
+        if len(header) < HEADER.size:
+            return False
+        magic, fmt, record_size, capacity, _ = HEADER.unpack(header)
+        return (magic, fmt, record_size, capacity) == (MAGIC, FORMAT_VERSION, RECORD.size, self.capacity)
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def _offset(self, i: int) -> int:
+        # i-th oldest record still held
+        seq = self.written - len(self) + i
+        return HEADER_SIZE + (seq % self.capacity) * RECORD.size
+
+    def append(self, field: str, is_on: bool, brightness: int, color: str, version: int,
+               source: str = "local", request_id: Optional[str] = None, ts: Optional[float] = None) -> None:
+        with self._lock:
+            seq = self.written
+            RECORD.pack_into(
+                self._map, HEADER_SIZE + (seq % self.capacity) * RECORD.size,
+                time.time() if ts is None else ts, seq, version, int(color[1:], 16), brightness, int(is_on),
+                FIELDS.index(field), SOURCES.index(source), (request_id or "").encode()[:36],
+            )
+            self.written = seq + 1
+            # the counter goes last: a crash mid-record leaves the previous tail intact
+            struct.pack_into("<Q", self._map, WRITTEN_OFFSET, self.written)
+
+    def _read(self, i: int) -> Dict[str, Any]:
+        ts, seq, version, color, brightness, is_on, field, source, request_id = RECORD.unpack_from(self._map, self._offset(i))
+        return {
+            "ts": ts,
+            "seq": seq,
+            "version": version,
+            "field": FIELDS[field],
+            "value": _value(FIELDS[field], is_on, brightness, color),
+            "source": SOURCES[source],
+            "request_id": request_id.rstrip(b"\0").decode(errors="replace") or None,
+            "state": {"is_on": bool(is_on), "brightness": brightness, "color": f"#{color:06X}"},
+        }
+
+    def last(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._read(len(self) - 1) if len(self) else None
+
+    def range(self, since: float = 0.0, until: Optional[float] = None, limit: int = 1000) -> Tuple[List[Dict[str, Any]], bool]:
+        # Records with since <= ts < until, oldest first, and whether more were left out by `limit`.
+        # Two binary searches over the timestamps, then only the matching records are decoded.
+        # Records are in write order, so this assumes the wall clock never stepped back.
+        with self._lock:
+            timestamps = _Timestamps(self, len(self))
+            lo = bisect.bisect_left(timestamps, since)
+            hi = len(self) if until is None else bisect.bisect_left(timestamps, until, lo)
+            return [self._read(i) for i in range(lo, min(hi, lo + limit))], hi - lo > limit
+
+    def close(self) -> None:
+        with self._lock:
+            self._map.close()
+
+
+def open_journal(path: Optional[str], capacity: int) -> Optional[Journal]:
+    if not path:
+        return None
+    try:
+        return Journal(path, capacity)
+    except (OSError, ValueError) as e:
+        print(f"[JOURNAL] disabled, cannot open {path}: {e}")
+        return None
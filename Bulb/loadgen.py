@@ -0,0 +1,241 @@
+import argparse
+import contextlib
+import csv
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+
+import scenario
+
+DEFAULT_MIX = "run_random_scenario=0.6,change_color=0.3,party_mode=0.1"
+# histogram bucket upper bounds in ms, roughly x2 per bucket
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, math.inf]
+
+
+def parse_duration(text: str) -> float:
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", text)
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid duration '{text}', expected e.g. 30s, 10m, 1h")
+    return float(m.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[m.group(2)]
+
+
+def parse_rate(text: str) -> float:
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(?:/\s*([smh]))?\s*", text)
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid rate '{text}', expected e.g. 200/s or 600/m")
+    return float(m.group(1)) / {None: 1, "s": 1, "m": 60, "h": 3600}[m.group(2)]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for item in filter(None, (x.strip() for x in text.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{name}', expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("mix needs at least one positive weight")
+    return mix
+
+
+# each takes the controller's rng
+OPERATIONS = {
+    "run_random_scenario": lambda rng: scenario.run_random_scenario("cloud"),
+    "change_color": lambda rng: scenario.change_color("cloud", rng.choice(list(scenario.THEMES))),
+    "party_mode": lambda rng: scenario.party_mode("cloud", rng.choice(list(scenario.THEMES))),
+}
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, operation: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.samples.setdefault(operation, []).append(seconds * 1000)
+            if not ok:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def summary(self, elapsed: float) -> List[Dict]:
+        rows = []
+        with self._lock:
+            items = sorted((op, sorted(v)) for op, v in self.samples.items())
+            errors = dict(self.errors)
+        for op, lat in items:
+            count = len(lat)
+            histogram, i = [], 0
+            for bound in BUCKETS_MS:
+                n = 0
+                while i < count and lat[i] <= bound:
+                    n += 1
+                    i += 1
+                histogram.append({"le_ms": bound if bound != math.inf else "inf", "count": n})
+            rows.append({
+                "operation": op,
+                "count": count,
+                "errors": errors.get(op, 0),
+                "error_rate": round(errors.get(op, 0) / count, 4) if count else 0.0,
+                "throughput_per_s": round(count / elapsed, 2) if elapsed else 0.0,
+                "mean_ms": round(sum(lat) / count, 2) if count else 0.0,
+                "p50_ms": round(percentile(lat, 50), 2),
+                "p95_ms": round(percentile(lat, 95), 2),
+                "p99_ms": round(percentile(lat, 99), 2),
+                "max_ms": round(lat[-1], 2) if lat else 0.0,
+                "histogram": histogram,
+            })
+        return rows
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+class Pacer:
+    # Global start-rate limit shared by every controller (evenly spaced slots).
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self, deadline: float) -> bool:
+        if not self.interval:
+            return time.monotonic() < deadline
+        with self._lock:
+            slot = max(self._next, time.monotonic())
+            self._next = slot + self.interval
+        if slot >= deadline:
+            return False
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+def controller(pacer: Pacer, deadline: float, mix: Dict[str, float], recorder: Recorder, seed: Optional[int]) -> None:
+    # one household per controller: the scenario code draws from this rng and mirrors its own bulb state
+    rng = random.Random(seed)
+    scenario.household_rng.set(rng)
+    scenario.household_mirror.set(scenario.StateMirror(scenario.STATE_MIRROR_TTL))
+    names, weights = list(mix), list(mix.values())
+    while pacer.wait(deadline):
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        ok = True
+        try:
+            OPERATIONS[name](rng)
+        except Exception:
+            ok = False
+        recorder.record(f"scenario:{name}", time.perf_counter() - started, ok)
+
+
+@contextlib.contextmanager
+def local_stack():
+    # Stand-in bulb + cloud on loopback ports, both in this process.
+    from werkzeug.serving import make_server
+    import bulb
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    bulb_server = make_server("127.0.0.1", 0, bulb.app, threaded=True)
+    os.environ["BULB_HOST"] = f"http://127.0.0.1:{bulb_server.server_port}"
+    os.environ.pop("DEVICES", None)
+    os.environ.pop("DEVICES_FILE", None)
+    cloud_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Cloud")
+    if not os.path.isdir(cloud_dir):
+        raise SystemExit("--local needs the Cloud/ directory next to Bulb/ (run from a repo checkout)")
+    sys.path.insert(0, cloud_dir)
+    import cloud_server
+
+    cloud_server.API_KEY = scenario.API_KEY
+    cloud_srv = make_server("127.0.0.1", 0, cloud_server.app, threaded=True)
+    servers = [bulb_server, cloud_srv]
+    for srv in servers:
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{cloud_srv.server_port}"
+    finally:
+        for srv in servers:
+            srv.shutdown()
+
+
+def write_reports(rows: List[Dict], meta: Dict, prefix: str) -> Tuple[str, str]:
+    json_path, csv_path = f"{prefix}.json", f"{prefix}.csv"
+    with open(json_path, "w") as f:
+        json.dump({"meta": meta, "operations": rows}, f, indent=2)
+    fields = [k for k in rows[0] if k != "histogram"] if rows else ["operation"]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    return json_path, csv_path
+
+
+def run(controllers: int, rate: float, duration: float, mix: Dict[str, float],
+        seed: Optional[int] = None, verbose: bool = False) -> Tuple[List[Dict], float]:
+    recorder = Recorder()
+    scenario.request_observer = recorder.record
+    scenario.THINK_TIME_SCALE = 0.0
+    # one pooled connection per controller; no client-side retries so failures show up as errors
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=controllers)
+    scenario.session.mount("https://", adapter)
+    scenario.session.mount("http://", adapter)
+
+    deadline = time.monotonic() + duration
+    pacer = Pacer(rate)
+    started = time.perf_counter()
+    # scenario.py prints every step; muted so the controllers measure the cloud, not the terminal
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=controllers, thread_name_prefix="controller"))
+        for i in range(controllers):
+            pool.submit(controller, pacer, deadline, mix, recorder, None if seed is None else seed + i)
+    elapsed = time.perf_counter() - started
+    scenario.request_observer = None
+    return recorder.summary(elapsed), elapsed
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Concurrent load generator for the smart bulb cloud.")
+    parser.add_argument("--controllers", type=int, default=50, help="simulated controllers running concurrently")
+    parser.add_argument("--rate", type=parse_rate, default=parse_rate("50/s"), help="scenario starts per second, e.g. 200/s (0 = unlimited)")
+    parser.add_argument("--duration", type=parse_duration, default=parse_duration("1m"), help="e.g. 30s, 10m")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default="loadgen", help="report prefix, writes PREFIX.json and PREFIX.csv")
+    parser.add_argument("--local", action="store_true", help="start a stand-in bulb and cloud in-process and target them")
+    parser.add_argument("--verbose", action="store_true", help="keep scenario.py's per-step output")
+    args = parser.parse_args(argv)
+
+    with (local_stack() if args.local else contextlib.nullcontext(scenario.BASE_URL)) as base_url:
+        scenario.BASE_URL = base_url
+        print(f"[LOAD] {args.controllers} controllers, rate={args.rate:g}/s, duration={args.duration:g}s against {base_url}")
+        rows, elapsed = run(args.controllers, args.rate, args.duration, args.mix, args.seed, args.verbose)
+
+    meta = {"controllers": args.controllers, "rate_per_s": args.rate, "duration_s": args.duration,
+            "elapsed_s": round(elapsed, 3), "mix": args.mix, "target": base_url, "seed": args.seed}
+    json_path, csv_path = write_reports(rows, meta, args.out)
+    print(f"{'operation':<32}{'count':>8}{'err%':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for row in rows:
+        print(f"{row['operation']:<32}{row['count']:>8}{row['error_rate'] * 100:>7.1f}%{row['throughput_per_s']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+    print(f"[LOAD] reports written to {json_path} and {csv_path}")
+
+
+if __name__ == "__main__":
+    main()
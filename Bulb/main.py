@@ -1,35 +1,53 @@
+import asyncio
 import threading
-import time
-import random
 import os
-import traceback
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from flask import jsonify
 
-from network import send_arp, heartbeat, network_discovery
-from bulb import app as control_app
-from scenario import main
+from network import (ArpKeepalive, CommandChannel, DiscoveryResponder, Heartbeat, discovery_socket,
+                     CHANNEL_URL, DISCOVERY_INTERVAL, HEARTBEAT_SECONDS)
+from bulb import app as control_app, enable_journal
+from scenario import cycle as scenario_cycle
+from scheduler import Job, Scheduler
 
-def scenario_loop():
-    print("[THREAD] scenario_loop started")
-    while True:
-        try:
-            main()
-        except Exception:
-            print("[ERROR] Scenario crashed:")
-            traceback.print_exc()
-        time.sleep(random.randint(60, 180))
+ROUTER_IP = os.getenv("ROUTER_IP", "192.168.0.1")
+CLOUD_IP = os.getenv("CLOUD_IP", "www.cesieat.ovh")
+ARP_SECONDS = float(os.getenv("ARP_SECONDS", "30"))
+
+# every periodic job of the bulb, in one place: name, interval, jitter, backoff
+scheduler = Scheduler(max_workers=3 if CHANNEL_URL else 2)
+arp = ArpKeepalive(ROUTER_IP)
+heartbeat = Heartbeat(CLOUD_IP)
+discovery = DiscoveryResponder()
+
+scheduler.add(Job("arp", arp.send, ARP_SECONDS, jitter=0.1))
+scheduler.add(Job("heartbeat", heartbeat.send, HEARTBEAT_SECONDS, jitter=0.1, backoff_max=HEARTBEAT_SECONDS * 2))
+scheduler.add(Job("discovery", discovery.announce, DISCOVERY_INTERVAL, jitter=0.2, blocking=False))
+# a scenario tick runs for as long as the simulated household is active, then says when to come back
+scheduler.add(Job("scenario", scenario_cycle, 60, jitter=0.0, backoff_max=180, initial_delay=1))
+if CHANNEL_URL:
+    # one long run per connection; reconnects back off while the cloud is unreachable
+    scheduler.add(Job("channel", CommandChannel(CHANNEL_URL).run, 5, jitter=0.2, backoff_max=120))
+
+async def open_discovery(loop):
+    await loop.create_datagram_endpoint(lambda: discovery, sock=discovery_socket())
+
+scheduler.on_start(open_discovery)
+
+@control_app.route("/jobs", methods=["GET"])
+def jobs():
+    return jsonify(scheduler.stats())
 
 if __name__ == "__main__":
+    # the journal belongs to the device process only: in-process users of bulb start from a blank bulb
+    enable_journal()
     threading.Thread(
         target=lambda: control_app.run(host="0.0.0.0", port=5000),
         daemon=True
     ).start()
 
-    threading.Thread(target=send_arp, daemon=True).start()
-    threading.Thread(target=heartbeat, daemon=True).start()
-    threading.Thread(target=network_discovery, daemon=True).start()
-    threading.Thread(target=scenario_loop, daemon=True).start()
-
-    while True:
-        time.sleep(60)
+    try:
+        asyncio.run(scheduler.run())
+    except KeyboardInterrupt:
+        print("\n[SIM] Stopped")
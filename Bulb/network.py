@@ -1,38 +1,231 @@
+import asyncio
+import json
 import os
 import requests
 import socket
-import time
+import ssl
+import struct
+import subprocess
+
+import simple_websocket
+
+from bulb import app, bulb
+from discovery import DISCOVERY_PORT, PROBE, announcement, decode
+
+# Each helper here does one tick of work; main.py's scheduler decides when they run.
 
 #Keep alive / ARP
 
-def send_arp(router_ip="192.168.0.1"):
-    while True:
-        print(f"[ARP] sending ARP to {router_ip}")
-        os.system(f"arping -c 1 {router_ip}")
-        time.sleep(30)
+ARP_INTERFACE = os.getenv("ARP_INTERFACE")
+ETH_P_ARP = 0x0806
 
-#Heartbeat
+def default_interface():
+    # interface of the default route, from /proc/net/route
+    with open("/proc/net/route") as f:
+        for line in f.readlines()[1:]:
+            fields = line.split()
+            if fields[1] == "00000000":
+                return fields[0]
+    raise OSError("no default route")
+
+def arp_request_frame(src_mac, src_ip, target_ip):
+    # "who-has target_ip tell src_ip", broadcast
+    return (
+        b"\xff" * 6 + src_mac + struct.pack("!H", ETH_P_ARP)
+        + struct.pack("!HHBBH", 1, 0x0800, 6, 4, 1)
+        + src_mac + socket.inet_aton(src_ip)
+        + b"\x00" * 6 + socket.inet_aton(target_ip)
+    )
+
+class ArpKeepalive:
+    # Same request as `arping -c 1 router`, sent from a raw socket kept open between ticks.
+    # Without CAP_NET_RAW (or off Linux) it falls back to running arping.
+    def __init__(self, router_ip="192.168.0.1", interface=None):
+        self.router_ip = router_ip
+        self.interface = interface or ARP_INTERFACE
+        self._sock = None
+        self._frame = None
+        self.fallback = False
+
+    def _open(self):
+        interface = self.interface or default_interface()
+        with open(f"/sys/class/net/{interface}/address") as f:
+            mac = bytes.fromhex(f.read().strip().replace(":", ""))
+        # source address the kernel would use to reach the router (connect() on UDP sends nothing)
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.connect((self.router_ip, 9))
+            src_ip = probe.getsockname()[0]
+        finally:
+            probe.close()
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+        sock.bind((interface, 0))
+        self._sock, self._frame = sock, arp_request_frame(mac, src_ip, self.router_ip)
+        print(f"[ARP] raw socket on {interface} ({src_ip}) ready")
 
-def heartbeat(cloud_ip="www.cesieat.ovh"):
-    while True:
+    def send(self):
+        if not self.fallback and self._sock is None:
+            try:
+                self._open()
+            except (OSError, AttributeError) as e:
+                print(f"[ARP] raw socket unavailable ({e}), using arping")
+                self.fallback = True
+        if self.fallback:
+            subprocess.run(["arping", "-c", "1", self.router_ip], stdout=subprocess.DEVNULL, check=True)
+            return
         try:
-            print("[HEARTBEAT] Sending to cloud...")
-            requests.post(f"https://{cloud_ip}/heartbeat", json={"status": "alive"}, verify=False)
-        except Exception as e:
-            print(f"[HEARTBEAT] Failed: {e}")
-        time.sleep(60)
+            self._sock.send(self._frame)
+        except OSError:
+            # interface went down or changed: reopen on the next tick
+            self.close()
+            raise
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+#Heartbeat
+
+DEVICE_ID = os.getenv("DEVICE_ID", "default")
+API_KEY = os.getenv("API_KEY")
+HEARTBEAT_SECONDS = float(os.getenv("HEARTBEAT_SECONDS", "60"))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "5"))
+HEARTBEAT_VERIFY_TLS = os.getenv("HEARTBEAT_VERIFY_TLS", "false").lower() == "true"
+
+def heartbeat_payload():
+    # version/etag/digest let the cloud confirm or drop its cached copy of our state
+    with bulb.lock:
+        return {
+            "status": "alive",
+            "device_id": DEVICE_ID,
+            "interval": HEARTBEAT_SECONDS,
+            "version": bulb.version,
+            "etag": bulb.etag(),
+            "digest": bulb.digest(),
+        }
+
+class Heartbeat:
+    def __init__(self, cloud_ip="www.cesieat.ovh"):
+        self.url = f"https://{cloud_ip}/heartbeat"
+        # one keep-alive session: the TLS handshake is paid once, not every minute
+        self.session = requests.Session()
+        self.session.verify = HEARTBEAT_VERIFY_TLS
+        if API_KEY:
+            self.session.headers["X-API-Key"] = API_KEY
+
+    def send(self):
+        r = self.session.post(self.url, json=heartbeat_payload(), timeout=HEARTBEAT_TIMEOUT)
+        r.raise_for_status()
 
 #Discovery
 
-def network_discovery():
-    discovery_message = "SMARTBULB_DISCOVERY"
-    broadcast_ip = "255.255.255.255"
-    port = 37020
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", "5000"))
+CONTROL_SCHEME = os.getenv("CONTROL_SCHEME", "http")
+DISCOVERY_INTERVAL = float(os.getenv("DISCOVERY_INTERVAL", "20"))
+BROADCAST_IP = "255.255.255.255"
+
+def discovery_message():
+    with bulb.lock:
+        return announcement(DEVICE_ID, CONTROL_PORT, bulb.version, bulb.etag(), CONTROL_SCHEME)
 
+def discovery_socket():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # bound to the discovery port so controllers can probe us instead of waiting for the next broadcast
+    sock.bind(("", DISCOVERY_PORT))
+    sock.setblocking(False)
+    return sock
+
+class DiscoveryResponder(asyncio.DatagramProtocol):
+    # asyncio datagram protocol: answers probes as they arrive, broadcasts when announce() is called
+    def __init__(self):
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        msg = decode(data)
+        if msg and msg["type"] == PROBE and msg.get("device_id") in (None, DEVICE_ID):
+            self.transport.sendto(discovery_message(), addr)
+
+    def error_received(self, exc):
+        print(f"[DISCOVERY] socket error: {exc}")
+
+    def connection_lost(self, exc):
+        self.transport = None
 
-    while True:
-        print(f"[DISCOVERY] Broadcasting '{discovery_message}' to {broadcast_ip}:{port}")
-        sock.sendto(discovery_message.encode(), (broadcast_ip, port))
-        time.sleep(20)
+    def announce(self):
+        if self.transport is None:
+            raise OSError("discovery socket is closed")
+        self.transport.sendto(discovery_message(), (BROADCAST_IP, DISCOVERY_PORT))
+
+#Command channel
+
+# e.g. wss://www.cesieat.ovh/cloud/channel; unset = the cloud only reaches us over HTTP
+CHANNEL_URL = os.getenv("CHANNEL_URL")
+CHANNEL_PING_SECONDS = float(os.getenv("CHANNEL_PING_SECONDS", "30"))
+# command name -> our route; the cloud sends the name in place of the route (Cloud/channels.py ROUTE_OPS)
+COMMAND_ROUTES = {
+    "status": ("GET", "/status"),
+    "on": ("POST", "/on"),
+    "off": ("POST", "/off"),
+    "brightness": ("POST", "/brightness"),
+    "color": ("POST", "/color"),
+    "state": ("POST", "/state"),
+    "effect": ("POST", "/effect"),
+    "effect_stop": ("POST", "/effect/stop"),
+}
+# response headers acked back with the result
+ACK_HEADERS = ("ETag",)
+
+class CommandChannel:
+    # Outbound WebSocket to the cloud: each command frame is replayed against our own
+    # Flask routes (same validation, ETag and effect handling as HTTP) and acked by id.
+    def __init__(self, url, device_id=DEVICE_ID):
+        self.url = url
+        self.device_id = device_id
+        self.client = app.test_client()
+
+    def handle(self, frame):
+        route = COMMAND_ROUTES.get(frame.get("op"))
+        if route is None:
+            return {"id": frame.get("id"), "status": 400, "body": {"error": "unknown_op", "message": str(frame.get("op"))}}
+        method, path = route
+        resp = self.client.open(path, method=method, json=frame.get("args"), headers=frame.get("headers") or {})
+        body = resp.get_json(silent=True) if resp.is_json else resp.get_data(as_text=True)
+        headers = {k: resp.headers[k] for k in ACK_HEADERS if k in resp.headers}
+        return {"id": frame.get("id"), "status": resp.status_code, "body": body, "headers": headers}
+
+    def run(self):
+        # Connects and serves until the connection drops; returns the pause before reconnecting.
+        headers = {"X-Device-Id": self.device_id}
+        if API_KEY:
+            headers["X-API-Key"] = API_KEY
+        ssl_context = None
+        if not HEARTBEAT_VERIFY_TLS:
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        # ping_interval: a cloud that stops answering pings closes the connection from our side
+        ws = simple_websocket.Client.connect(self.url, headers=headers, ping_interval=CHANNEL_PING_SECONDS,
+                                             ssl_context=ssl_context)
+        print(f"[CHANNEL] connected to {self.url} as '{self.device_id}'")
+        try:
+            while True:
+                text = ws.receive()
+                try:
+                    frame = json.loads(text)
+                except ValueError:
+                    continue
+                ws.send(json.dumps(self.handle(frame), separators=(",", ":")))
+        except simple_websocket.ConnectionClosed as e:
+            print(f"[CHANNEL] closed: {e}")
+            return 1.0
+        finally:
+            try:
+                ws.close()
+            except (OSError, simple_websocket.ConnectionClosed):
+                pass
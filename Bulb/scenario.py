@@ -1,27 +1,83 @@
 import os
+import threading
 import time
 import random
 import uuid
-import subprocess
-from typing import Optional, Dict, Any
+from contextvars import ContextVar
+from typing import Callable, Optional, Dict, Any
 
 import requests
 from urllib3.util import Retry
 from requests.adapters import HTTPAdapter
 
+from chiptool import ChipToolCommandFailed, ChipToolError, ChipToolPool, run_oneshot
+from discovery import DiscoveryCache, DiscoveryListener, probe
+
 CLOUD_HOST = os.getenv("CLOUD_HOST", "www.cesieat.ovh")
-BASE_URL = f"https://{CLOUD_HOST}"
+# CLOUD_URL (e.g. http://127.0.0.1:6000) overrides the https://CLOUD_HOST default
+BASE_URL = os.getenv("CLOUD_URL") or f"https://{CLOUD_HOST}"
 VERIFY_TLS = os.getenv("VERIFY_TLS", "true").lower() != "false"
 API_KEY = os.getenv("API_KEY") or None
 REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5"))
 
+class SystemClock:
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+class VirtualClock:
+    # Simulated time: sleep() returns at once and moves the clock forward instead.
+    def __init__(self, start: float = 0.0):
+        self.start = start
+        self.elapsed = 0.0
+
+    def time(self) -> float:
+        return self.start + self.elapsed
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def sleep(self, seconds: float) -> None:
+        self.elapsed += max(0.0, seconds)
+
+# every wait and every random draw of the household goes through these two, so a run can be
+# replayed from its seed or compressed in time (simulate.py swaps in a VirtualClock)
+clock = SystemClock()
+rng = random.Random(int(os.environ["SCENARIO_SEED"]) if os.getenv("SCENARIO_SEED") else None)
+# loadgen runs many households in one process: each controller binds its own rng (and state mirror,
+# below) in its thread; everyone else gets the module-level ones
+household_rng: ContextVar[Optional[random.Random]] = ContextVar("household_rng", default=None)
+
+def _rng() -> random.Random:
+    bound = household_rng.get()
+    return rng if bound is None else bound
+
 def get_backend() -> str:
-    return (os.getenv("BACKEND") or random.choice(["cloud", "matter"])).lower()
+    return (os.getenv("BACKEND") or _rng().choice(["cloud", "matter"])).lower()
+
+# BACKEND=local: talk to the bulb found by UDP discovery on the LAN, falling back to the cloud
+LOCAL_DEVICE_ID = os.getenv("LOCAL_DEVICE_ID", os.getenv("DEVICE_ID", "default"))
+LOCAL_TIMEOUT = float(os.getenv("LOCAL_TIMEOUT", "2"))
+DISCOVERY_TTL = float(os.getenv("DISCOVERY_TTL", "60"))
+DISCOVERY_PROBE_TIMEOUT = float(os.getenv("DISCOVERY_PROBE_TIMEOUT", "0.5"))
+# probe destination; a subnet broadcast such as 192.168.0.255 when the default route is elsewhere
+DISCOVERY_ADDRESS = os.getenv("DISCOVERY_ADDRESS", "255.255.255.255")
+# after a probe found nothing, stay on the cloud this long before probing again
+DISCOVERY_RETRY_SECONDS = float(os.getenv("DISCOVERY_RETRY_SECONDS", "30"))
 
 CHIP_TOOL = os.getenv("CHIP_TOOL", "./out/chip-tool/chip-tool")
 CHIP_TOOL_CWD = os.getenv("CHIP_TOOL_CWD", "/home/ucd/connectedhomeip")
 NODE_ID = os.getenv("MATTER_NODE_ID", "1")
 ENDPOINT = os.getenv("MATTER_ENDPOINT", "3")
+# interactive: long-lived chip-tool session(s) fed over stdin; oneshot: one process per command
+CHIPTOOL_MODE = os.getenv("CHIPTOOL_MODE", "interactive").lower()
+CHIPTOOL_POOL_SIZE = int(os.getenv("CHIPTOOL_POOL_SIZE", "1"))
+CHIPTOOL_TIMEOUT = float(os.getenv("CHIPTOOL_TIMEOUT", "30"))
 
 ACTIVE_RATIO = 0.11
 IDLE_SLEEP_RANGE = (60, 300)
@@ -29,6 +85,12 @@ CYCLE_SLEEP = 1
 
 PARTY_STEPS_RANGE = (5, 15)
 PARTY_WAIT_RANGE = (0.4, 1.5)
+# true: the whole party is sent as one on-bulb effect instead of one PATCH per color
+PARTY_AS_EFFECT = os.getenv("PARTY_AS_EFFECT", "true").lower() != "false"
+# multiplies every simulated wait; the load generator sets it to 0 to drive the cloud flat out
+THINK_TIME_SCALE = float(os.getenv("THINK_TIME_SCALE", "1"))
+# how long the state learnt from our own writes is trusted before reading /cloud again (0 = always read)
+STATE_MIRROR_TTL = float(os.getenv("STATE_MIRROR_TTL", "30"))
 
 THEMES = {
     "party":   ["#FF0040", "#FF8000", "#FFD300", "#00E5FF", "#7D00FF", "#00FF85"],
@@ -49,6 +111,27 @@ retries = Retry(
     allowed_methods={"GET", "PATCH"},
 )
 session.mount("https://", HTTPAdapter(max_retries=retries))
+session.mount("http://", HTTPAdapter(max_retries=retries))
+
+# no retries on the LAN: a failure means falling back to the cloud right away
+local_session = requests.Session()
+
+# called as observer(operation, seconds, ok) after each cloud request; set by the load generator
+request_observer: Optional[Callable[[str, float, bool], None]] = None
+# called as observer(action, backend) for each scenario started and each action taken; set by the simulator
+action_observer: Optional[Callable[[str, str], None]] = None
+
+def _observe(operation: str, started: float, ok: bool) -> None:
+    if request_observer is not None:
+        request_observer(operation, time.perf_counter() - started, ok)
+
+def _observe_action(action: str, backend: str) -> None:
+    if action_observer is not None:
+        action_observer(action, backend)
+
+def _sleep(seconds: float) -> None:
+    if seconds * THINK_TIME_SCALE > 0:
+        clock.sleep(seconds * THINK_TIME_SCALE)
 
 def _headers(extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
     h = {"Content-Type": "application/json"}
@@ -58,17 +141,111 @@ def _headers(extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
         h.update(extra)
     return h
 
-def get_status() -> Dict[str, Any]:
-    r = session.get(f"{BASE_URL}/cloud", verify=VERIFY_TLS, timeout=REQUEST_TIMEOUT, headers=_headers())
-    r.raise_for_status()
-    data = r.json()
+# write field -> status field, to predict the bulb's version after a write
+_STATUS_FIELDS = {"enabled": "is_on", "brightness": "brightness", "color": "color"}
+
+class StateMirror:
+    # Last known bulb state (+ version and ETag). Kept current from the state our own writes return,
+    # so actions don't read /cloud after every write; re-read once older than ttl or marked dirty.
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.state: Optional[Dict[str, Any]] = None
+        self.version: Optional[int] = None
+        self.etag: Optional[str] = None
+        self.updated = 0.0
+        self.dirty = True
+        self._lock = threading.Lock()
+
+    def fresh(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self.state is None or self.dirty or clock.monotonic() - self.updated >= self.ttl:
+                return None
+            return self.state
+
+    def update(self, state: Dict[str, Any], etag: Optional[str] = None) -> None:
+        with self._lock:
+            self.state = state
+            self.version = state.get("version")
+            self.etag = etag
+            self.updated = clock.monotonic()
+            self.dirty = False
+
+    def confirm(self) -> None:
+        # 304: what we hold is still what the bulb has
+        with self._lock:
+            self.updated = clock.monotonic()
+            self.dirty = False
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.dirty = True
+
+    def record_write(self, payload: Dict[str, Any], state: Optional[Dict[str, Any]], etag: Optional[str] = None) -> bool:
+        # Returns True on a version gap: the bulb moved further than our write explains, so someone
+        # else changed it and the mirror is re-read before the next decision.
+        if state is None or "effect" in payload:
+            self.invalidate()
+            return False
+        with self._lock:
+            expected = None
+            if self.state is not None and self.version is not None:
+                # the bulb bumps its version once per field whose value really changes
+                expected = self.version + sum(
+                    1 for k, v in payload.items() if k in _STATUS_FIELDS and self.state.get(_STATUS_FIELDS[k]) != v)
+            gap = expected is not None and state.get("version") is not None and state["version"] != expected
+        self.update(state, etag)
+        if gap:
+            print(f"[MIRROR] version {state['version']} after our write, expected {expected}: re-reading next time")
+            self.invalidate()
+        return gap
+
+state_mirror = StateMirror(STATE_MIRROR_TTL)
+household_mirror: ContextVar[Optional[StateMirror]] = ContextVar("household_mirror", default=None)
+
+def _mirror() -> StateMirror:
+    bound = household_mirror.get()
+    return state_mirror if bound is None else bound
+
+def get_status(backend: Optional[str] = None) -> Dict[str, Any]:
+    if backend == "local":
+        data = _local_call("GET", "/status")
+        if data is not None:
+            _mirror().update(data)
+            print(f"[STATUS][LOCAL] enabled={data.get('enabled')} brightness={data.get('brightness')} color={data.get('color')}")
+            return data
+    mirror = _mirror()
+    cached, etag = mirror.state, mirror.etag
+    # conditional GET (304 when nothing changed)
+    extra = {"If-None-Match": etag} if etag and cached else None
+    started = time.perf_counter()
+    try:
+        r = session.get(f"{BASE_URL}/cloud", verify=VERIFY_TLS, timeout=REQUEST_TIMEOUT, headers=_headers(extra))
+        if r.status_code == 304:
+            data = cached
+            mirror.confirm()
+        else:
+            r.raise_for_status()
+            data = r.json()
+            mirror.update(data, r.headers.get("ETag"))
+    except Exception:
+        _observe("GET /cloud", started, False)
+        raise
+    _observe("GET /cloud", started, True)
     print(f"[STATUS] enabled={data.get('enabled')} brightness={data.get('brightness')} color={data.get('color')}")
     return data
 
+def read_state(backend: Optional[str] = None) -> Dict[str, Any]:
+    # the mirror while it is fresh, the bulb otherwise
+    state = _mirror().fresh()
+    if state is not None:
+        return state
+    return get_status(backend)
+
 def patch_cloud(enabled: Optional[bool] = None,
                 brightness: Optional[int] = None,
                 color: Optional[str] = None,
-                idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+                idempotency_key: Optional[str] = None,
+                effect: Optional[Any] = None) -> Dict[str, Any]:
     payload: Dict[str, Any] = {}
     if enabled is not None:
         payload["enabled"] = bool(enabled)
@@ -79,6 +256,8 @@ def patch_cloud(enabled: Optional[bool] = None,
         if not (isinstance(color, str) and len(color) == 7 and color.startswith('#')):
             raise ValueError("color must be in format #RRGGBB")
         payload["color"] = color
+    if effect is not None:
+        payload["effect"] = effect
 
     if not payload:
         return {"noop": True}
@@ -88,16 +267,97 @@ def patch_cloud(enabled: Optional[bool] = None,
         idempotency_key = str(uuid.uuid4())
     headers["Idempotency-Key"] = idempotency_key
 
-    r = session.patch(f"{BASE_URL}/cloud", json=payload, verify=VERIFY_TLS, timeout=REQUEST_TIMEOUT, headers=headers)
-    r.raise_for_status()
-    data = r.json()
+    started = time.perf_counter()
+    try:
+        r = session.patch(f"{BASE_URL}/cloud", json=payload, verify=VERIFY_TLS, timeout=REQUEST_TIMEOUT, headers=headers)
+        r.raise_for_status()
+        data = r.json()
+    except Exception:
+        _observe("PATCH /cloud", started, False)
+        raise
+    _observe("PATCH /cloud", started, True)
     print(f"[PATCH] payload={payload} → applied={data.get('applied')}")
+    _mirror().record_write(payload, data.get("state"), data.get("etag"))
+    return data
+
+_discovery = DiscoveryCache(DISCOVERY_TTL)
+_discovery_listener: Optional[DiscoveryListener] = None
+_next_probe = 0.0
+
+def _local_base_url() -> Optional[str]:
+    global _discovery_listener, _next_probe
+    if _discovery_listener is None:
+        _discovery_listener = DiscoveryListener(_discovery)
+        try:
+            _discovery_listener.start()
+        except OSError as e:
+            print(f"[LOCAL] discovery listener unavailable ({e}), relying on probes")
+    info = _discovery.get(LOCAL_DEVICE_ID)
+    if info is None and clock.monotonic() >= _next_probe:
+        found = [i for i in probe(_discovery, LOCAL_DEVICE_ID, DISCOVERY_PROBE_TIMEOUT, address=DISCOVERY_ADDRESS) if i["device_id"] == LOCAL_DEVICE_ID]
+        if found:
+            info = found[0]
+            print(f"[LOCAL] found '{LOCAL_DEVICE_ID}' at {info['base_url']}")
+        else:
+            _next_probe = clock.monotonic() + DISCOVERY_RETRY_SECONDS
+    return info["base_url"] if info else None
+
+def _local_call(method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    # None means "use the cloud": bulb not discovered, or the LAN call failed
+    base_url = _local_base_url()
+    if base_url is None:
+        return None
+    started = time.perf_counter()
+    try:
+        r = local_session.request(method, f"{base_url}{path}", json=payload, timeout=LOCAL_TIMEOUT)
+        r.raise_for_status()
+        data = r.json()
+    except Exception as e:
+        _observe(f"LOCAL {method} {path}", started, False)
+        print(f"[LOCAL] {method} {path} failed ({e}), falling back to cloud")
+        _discovery.forget(LOCAL_DEVICE_ID)
+        return None
+    _observe(f"LOCAL {method} {path}", started, True)
     return data
 
-def _run_chiptool(argv: list[str]) -> None:
+def local_apply(**fields: Any) -> bool:
+    payload = {k: v for k, v in fields.items() if v is not None}
+    data = _local_call("POST", "/state", payload)
+    if data is None:
+        return False
+    print(f"[LOCAL] payload={payload} → state={data}")
+    _mirror().record_write(payload, data)
+    return True
+
+_chiptool_pool: Optional[ChipToolPool] = None
+
+def _get_chiptool_pool() -> ChipToolPool:
+    global _chiptool_pool
+    if _chiptool_pool is None:
+        _chiptool_pool = ChipToolPool(CHIP_TOOL, CHIP_TOOL_CWD, size=CHIPTOOL_POOL_SIZE, timeout=CHIPTOOL_TIMEOUT)
+    return _chiptool_pool
+
+def _run_chiptool(argv: list[str], node_id: str = NODE_ID) -> None:
+    # Matter reaches the bulb without the cloud: nothing tells us what state it ends up in
+    _mirror().invalidate()
+    _exec_chiptool(argv, node_id)
+
+def _exec_chiptool(argv: list[str], node_id: str = NODE_ID) -> None:
+    global CHIPTOOL_MODE
     cmd = [CHIP_TOOL] + argv
     print(f"[MATTER] $ {' '.join(cmd)}")
-    subprocess.run(cmd, check=True, cwd=CHIP_TOOL_CWD)
+    if CHIPTOOL_MODE == "interactive":
+        try:
+            _get_chiptool_pool().run(argv, node_id)
+            return
+        except ChipToolCommandFailed:
+            raise
+        except OSError as e:
+            print(f"[MATTER] interactive chip-tool unavailable ({e}), switching to one process per command")
+            CHIPTOOL_MODE = "oneshot"
+        except ChipToolError as e:
+            print(f"[MATTER] interactive session failed ({e}), retrying once as a single command")
+    run_oneshot(CHIP_TOOL, argv, cwd=CHIP_TOOL_CWD, timeout=CHIPTOOL_TIMEOUT)
 
 def _pct_to_level(value_0_100: int) -> int:
     v = max(0, min(100, int(value_0_100)))
@@ -121,6 +381,39 @@ def cloud_set_color(hex_color: str):
     print(f"[ACTION][CLOUD] Set color {hex_color}")
     patch_cloud(color=hex_color)
 
+def cloud_play_effect(effect: Dict[str, Any]):
+    print(f"[ACTION][CLOUD] Play effect mode={effect.get('mode', 'step')} keyframes={len(effect['keyframes'])} loop={effect.get('loop', 1)}")
+    patch_cloud(effect=effect)
+
+def local_turn_on():
+    print("[ACTION][LOCAL] Turning ON")
+    if not local_apply(enabled=True):
+        cloud_turn_on()
+
+def local_turn_off():
+    print("[ACTION][LOCAL] Turning OFF")
+    if not local_apply(enabled=False):
+        cloud_turn_off()
+
+def local_set_brightness(percent: int):
+    percent = max(0, min(100, int(percent)))
+    print(f"[ACTION][LOCAL] Set brightness {percent}%")
+    if not local_apply(brightness=percent):
+        cloud_set_brightness(percent)
+
+def local_set_color(hex_color: str):
+    hex_color = hex_color.upper()
+    print(f"[ACTION][LOCAL] Set color {hex_color}")
+    if not local_apply(color=hex_color):
+        cloud_set_color(hex_color)
+
+def local_play_effect(effect: Dict[str, Any]):
+    print(f"[ACTION][LOCAL] Play effect mode={effect.get('mode', 'step')} keyframes={len(effect['keyframes'])} loop={effect.get('loop', 1)}")
+    if _local_call("POST", "/effect", effect) is None:
+        cloud_play_effect(effect)
+    else:
+        _mirror().invalidate()
+
 def matter_turn_on():
     print("[ACTION][MATTER] Turning ON")
     _run_chiptool(["onoff", "on", NODE_ID, ENDPOINT])
@@ -146,32 +439,55 @@ def matter_set_brightness(percent: int):
 def turn_on(backend):
     if backend == "cloud":
         cloud_turn_on()
+    elif backend == "local":
+        local_turn_on()
     else:
         matter_turn_on()
 
 def turn_off(backend):
     if backend == "cloud":
         cloud_turn_off()
+    elif backend == "local":
+        local_turn_off()
     else:
         matter_turn_off()
 
 def set_brightness(percent: int, backend):
     if backend== "cloud":
         cloud_set_brightness(percent)
+    elif backend == "local":
+        local_set_brightness(percent)
     else:
         matter_set_brightness(percent)
 
 def set_color(hex_color: str, backend):
     if backend == "cloud":
         cloud_set_color(hex_color)
+    elif backend == "local":
+        local_set_color(hex_color)
     else:
         cloud_set_color(hex_color)
 
+def play_effect(effect: Dict[str, Any], backend):
+    # pas d'équivalent Matter : comme set_color, l'effet passe par le cloud
+    if backend == "local":
+        local_play_effect(effect)
+    else:
+        cloud_play_effect(effect)
+
+def theme_effect(theme: str, steps: int, wait_range=PARTY_WAIT_RANGE, mode: str = "step", loop: int = 1) -> Dict[str, Any]:
+    palette = THEMES.get(theme.lower(), THEMES["party"])
+    keyframes = [
+        {"color": _rng().choice(palette), "duration": round(_rng().uniform(*wait_range), 2)}
+        for _ in range(steps)
+    ]
+    return {"keyframes": keyframes, "mode": mode, "loop": loop}
+
 def increase_brightness(backend, cur: Optional[int] = None):
     if cur is None:
-        cur = int(get_status().get("brightness", 0))
+        cur = int(read_state(backend).get("brightness", 0))
     if cur < 100:
-        inc = random.randint(10, 30)
+        inc = _rng().randint(10, 30)
         new_val = min(100, cur + inc)
         print(f"[ACTION] Increasing brightness to {new_val}")
         set_brightness(new_val, backend)
@@ -180,9 +496,9 @@ def increase_brightness(backend, cur: Optional[int] = None):
 
 def decrease_brightness(backend, cur: Optional[int] = None):
     if cur is None:
-        cur = int(get_status().get("brightness", 0))
+        cur = int(read_state(backend).get("brightness", 0))
     if cur > 0:
-        dec = random.randint(10, 30)
+        dec = _rng().randint(10, 30)
         new_val = max(0, cur - dec)
         print(f"[ACTION] Decreasing brightness to {new_val}")
         set_brightness(new_val, backend)
@@ -190,43 +506,49 @@ def decrease_brightness(backend, cur: Optional[int] = None):
         print("[SKIP] Brightness already at 0%")
 
 def change_color(backend, theme: str = "party"):
-    state = get_status()
+    state = read_state(backend)
     if not state.get("enabled"):
         print("[INFO] Bulb is OFF, turning on for color change.")
         turn_on(backend)
     palette = THEMES.get(theme.lower(), THEMES["party"])
-    chosen = random.choice(palette)
+    chosen = _rng().choice(palette)
     print(f"[SCENARIO] Theme '{theme}' -> color {chosen}")
     set_color(chosen, backend)
 
 def party_mode(backend, theme: str = "party"):
-    state = get_status()
+    state = read_state(backend)
     if not state.get("enabled"):
         print("[INFO] Bulb is OFF, turning on for party mode.")
         turn_on(backend)
 
     current_theme = theme.lower()
-    steps = random.randint(*PARTY_STEPS_RANGE)
+    steps = _rng().randint(*PARTY_STEPS_RANGE)
     wait_min, wait_max = PARTY_WAIT_RANGE
     print(f"[PARTY] Start theme='{current_theme}', steps={steps}, wait={wait_min:.2f}-{wait_max:.2f}s")
 
-    for _ in range(steps):
-        palette = THEMES[current_theme]
-        set_color(random.choice(palette), backend )
-        time.sleep(random.uniform(wait_min, wait_max))
+    if PARTY_AS_EFFECT:
+        effect = theme_effect(current_theme, steps, (wait_min, wait_max))
+        play_effect(effect, backend)
+        # the bulb plays it on its own; just let it run before cooling down
+        _sleep(sum(kf["duration"] for kf in effect["keyframes"]))
+    else:
+        for _ in range(steps):
+            palette = THEMES[current_theme]
+            set_color(_rng().choice(palette), backend )
+            _sleep(_rng().uniform(wait_min, wait_max))
 
-    st = get_status()
-    if st.get("brightness", 0) > 30 and random.random() < 0.5:
+    st = read_state(backend)
+    if st.get("brightness", 0) > 30 and _rng().random() < 0.5:
         print("[PARTY] Cooling down: dimming a bit.")
         decrease_brightness(backend, st.get("brightness", 0))
 
 def wait_between_actions():
-    delay = random.randint(2, 10)
+    delay = _rng().randint(2, 10)
     print(f"[WAIT] Waiting {delay} seconds before next action...\n")
-    time.sleep(delay)
+    _sleep(delay)
 
 def run_random_scenario(backend):
-    st = get_status()
+    st = read_state(backend)
     enabled = bool(st.get("enabled"))
     bright = int(st.get("brightness", 0))
 
@@ -240,32 +562,55 @@ def run_random_scenario(backend):
                 possible.append(lambda: (increase_brightness(backend, bright), "inc_brightness"))
             if bright > 0:
                 possible.append(lambda: (decrease_brightness(backend, bright), "dec_brightness"))
-            possible.append(lambda: (change_color(backend, random.choice(list(THEMES.keys()))), "change_color"))
+            possible.append(lambda: (change_color(backend, _rng().choice(list(THEMES.keys()))), "change_color"))
 
         if possible:
-            action_fn = random.choice(possible)
+            action_fn = _rng().choice(possible)
             _, name = action_fn()
             print(f"[SCENARIO] Executed: {name}")
+            _observe_action(name, backend)
             wait_between_actions()
-            st = get_status()
+            st = read_state(backend)
             enabled = bool(st.get("enabled"))
             bright = int(st.get("brightness", 0))
 
+def cycle() -> float:
+    # one household tick; returns how long to wait before the next one
+    if _rng().random() < ACTIVE_RATIO:
+        backend = get_backend()
+        print(f"[SIM] controller using backend={backend.upper()} (state via {'LAN' if backend == 'local' else 'CLOUD'})")
+        print("[SCHEDULE] Active window: running scenario")
+        _observe_action("scenario", backend)
+        run_random_scenario(backend)
+        return CYCLE_SLEEP
+    idle_for = _rng().randint(*IDLE_SLEEP_RANGE)
+    print(f"[SCHEDULE] Idle for {idle_for}s")
+    return idle_for + CYCLE_SLEEP
+
 def main():
     while True:
-        if random.random() < ACTIVE_RATIO:
-            backend = get_backend()
-            print(f"[SIM] controller using backend={backend.upper()} (state via CLOUD)")
-            print("[SCHEDULE] Active window: running scenario")
-            run_random_scenario(backend)
-        else:
-            idle_for = random.randint(*IDLE_SLEEP_RANGE)
-            print(f"[SCHEDULE] Idle for {idle_for}s")
-            time.sleep(idle_for)
-        time.sleep(CYCLE_SLEEP)
+        clock.sleep(cycle())
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Smart bulb household simulator.")
+    parser.add_argument("--load", action="store_true", help="run the concurrent load generator instead of one household")
+    parser.add_argument("--virtual-time", action="store_true",
+                        help="simulate one household on a virtual clock against an in-process cloud (see --simulate)")
+    known, rest = parser.parse_known_args()
     try:
-        main()
+        if known.load:
+            import loadgen
+            loadgen.main(rest)
+        elif known.virtual_time:
+            import simulate
+            simulate.main(rest)
+        else:
+            parser.add_argument("--seed", type=int, default=None, help="seed the household's random choices")
+            seed = parser.parse_args().seed
+            if seed is not None:
+                rng.seed(seed)
+            main()
     except KeyboardInterrupt:
         print("\n[SIM] Stopped")
@@ -0,0 +1,120 @@
+import asyncio
+import random
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Job:
+    # fn() runs every `interval` seconds (+/- jitter as a fraction of the interval), measured
+    # from the start of each run. It may instead return a number: the pause after this run.
+    # After a failure the delay doubles, up to backoff_max, until a run succeeds.
+    def __init__(self, name: str, fn: Callable[[], Any], interval: float, jitter: float = 0.1,
+                 backoff_max: Optional[float] = None, blocking: bool = True, initial_delay: float = 0.0):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff_max = backoff_max if backoff_max is not None else interval * 8
+        # blocking jobs run on the scheduler's worker threads, the others on the event loop itself
+        self.blocking = blocking
+        self.initial_delay = initial_delay
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.overruns = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_started: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.next_run: Optional[float] = None
+
+    def jittered(self, delay: float) -> float:
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def backoff(self) -> float:
+        return min(self.interval * 2 ** self.consecutive_failures, self.backoff_max)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "overruns": self.overruns,
+            "last_duration_ms": round(self.last_duration * 1000, 2),
+            "max_duration_ms": round(self.max_duration * 1000, 2),
+            "mean_duration_ms": round(self.total_duration / self.runs * 1000, 2) if self.runs else 0.0,
+            "last_started": self.last_started,
+            "next_run_in": round(max(0.0, self.next_run - time.monotonic()), 1) if self.next_run else None,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    # One asyncio loop drives every periodic job; blocking ones borrow a thread from a small pool.
+    def __init__(self, max_workers: int = 2):
+        self.jobs: List[Job] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._setup: List[Callable[[asyncio.AbstractEventLoop], Any]] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def add(self, job: Job) -> Job:
+        self.jobs.append(job)
+        return job
+
+    def on_start(self, coro_fn: Callable[[asyncio.AbstractEventLoop], Any]) -> None:
+        # coroutine functions awaited once the loop is up (e.g. opening datagram endpoints)
+        self._setup.append(coro_fn)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {job.name: job.stats() for job in self.jobs}
+
+    async def _run_job(self, job: Job) -> None:
+        loop = asyncio.get_running_loop()
+        planned = loop.time() + job.initial_delay
+        while True:
+            job.next_run = time.monotonic() + max(0.0, planned - loop.time())
+            await asyncio.sleep(max(0.0, planned - loop.time()))
+            job.last_started = time.time()
+            t0 = loop.time()
+            result = None
+            try:
+                if job.blocking:
+                    result = await loop.run_in_executor(self._executor, job.fn)
+                else:
+                    result = job.fn()
+                    if asyncio.iscoroutine(result):
+                        result = await result
+                job.consecutive_failures = 0
+            except Exception as e:
+                job.failures += 1
+                job.consecutive_failures += 1
+                job.last_error = f"{type(e).__name__}: {e}"
+                print(f"[SCHED] job '{job.name}' failed ({job.last_error})")
+                if job.consecutive_failures == 1:
+                    # full trace once per streak; retries of the same outage stay one line each
+                    traceback.print_exc()
+            duration = loop.time() - t0
+            job.runs += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+            if job.consecutive_failures:
+                planned = loop.time() + job.backoff()
+            elif isinstance(result, (int, float)) and not isinstance(result, bool):
+                planned = loop.time() + job.jittered(result)
+            else:
+                # fixed rate: planned from this run's start; a run longer than that is an overrun
+                planned = t0 + job.jittered(job.interval)
+                if planned < loop.time():
+                    job.overruns += 1
+                    planned = loop.time()
+
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        for setup in self._setup:
+            await setup(self.loop)
+        await asyncio.gather(*(self._run_job(job) for job in self.jobs))
@@ -0,0 +1,204 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import scenario
+from loadgen import parse_duration
+
+SIM_CLOUD_URL = "http://cloud.sim"
+SIM_BULB_URL = "http://bulb.sim"
+
+
+class StandIn(BaseAdapter):
+    # The cloud and the bulb as scenario.py sees them, answered in-process from one bulb state.
+    # Every request (and every chip-tool command) is logged with its virtual timestamp.
+    def __init__(self, clock: scenario.VirtualClock):
+        super().__init__()
+        self.clock = clock
+        self.state: Dict[str, Any] = {"is_on": False, "brightness": 100, "color": "#FFFFFF"}
+        self.version = 0
+        self.log: List[Tuple[float, str]] = []
+
+    def record(self, operation: str) -> None:
+        self.log.append((self.clock.monotonic(), operation))
+
+    def status(self) -> Dict[str, Any]:
+        return dict(self.state, enabled=self.state["is_on"], version=self.version)
+
+    def etag(self) -> str:
+        return f'"sim-{self.version}"'
+
+    def apply(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        applied: Dict[str, Any] = {}
+        if fields.get("enabled") is not None:
+            applied["enabled"] = self._set("is_on", bool(fields["enabled"]))
+        if fields.get("brightness") is not None:
+            applied["brightness"] = self._set("brightness", max(0, min(100, int(fields["brightness"]))))
+        if fields.get("color") is not None:
+            applied["color"] = self._set("color", fields["color"].upper())
+        return applied
+
+    def _set(self, field: str, value: Any) -> Any:
+        # like SmartBulb._set: one version per field whose value really changes
+        if self.state[field] != value:
+            self.state[field] = value
+            self.version += 1
+        return value
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        operation = f"{request.method} {parts.path}"
+        if parts.netloc != urlsplit(SIM_CLOUD_URL).netloc:
+            operation = f"LOCAL {operation}"
+        self.record(operation)
+        body = json.loads(request.body) if request.body else {}
+        status, payload = self.route(request.method, parts.path, body, request.headers)
+        return self.build_response(request, status, payload)
+
+    def route(self, method: str, path: str, body: Dict[str, Any], headers) -> Tuple[int, Optional[Dict[str, Any]]]:
+        if method == "GET" and path in ("/cloud", "/status"):
+            if headers.get("If-None-Match") == self.etag():
+                return 304, None
+            return 200, self.status()
+        if method == "PATCH" and path == "/cloud":
+            applied = self.apply(body)
+            state = self.status()
+            if body.get("effect") is not None:
+                effect = body["effect"]
+                applied["effect"] = "stop" if effect == "stop" else {
+                    "mode": effect.get("mode", "step"), "loop": effect.get("loop", 1), "keyframes": len(effect["keyframes"])}
+                state = None
+            return 200, {"status": "ok", "applied": applied, "state": state, "version": state and state["version"],
+                         "etag": state and self.etag(), "request_id": f"sim-{len(self.log)}"}
+        if method == "POST" and path == "/state":
+            self.apply(body)
+            return 200, self.status()
+        if method == "POST" and path == "/effect":
+            return 200, {"running": True, "keyframes": len(body.get("keyframes", []))}
+        return 404, {"error": "not_found"}
+
+    def build_response(self, request, status: int, payload: Optional[Dict[str, Any]]) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = status
+        resp.request = request
+        resp.url = request.url
+        resp.reason = "OK" if status < 400 else "Error"
+        resp.headers = CaseInsensitiveDict({"ETag": self.etag()})
+        if payload is not None:
+            resp._content = json.dumps(payload).encode()
+            resp.headers["Content-Type"] = "application/json"
+        else:
+            resp._content = b""
+        return resp
+
+    def close(self) -> None:
+        pass
+
+    def chiptool(self, argv: List[str], node_id: str = scenario.NODE_ID) -> None:
+        # Matter commands reach the bulb without the cloud; logged, and applied so the state stays coherent
+        self.record(f"MATTER {' '.join(argv[:2])}")
+        if argv[:1] == ["onoff"]:
+            self.apply({"enabled": argv[1] == "on"})
+        elif argv[:4] == ["any", "write-by-id", "0x0008", "0x0000"]:
+            self.apply({"brightness": int(argv[4])})
+
+
+def peak(times: List[float], window: float) -> float:
+    # highest number of requests in any aligned window, as a per-second rate
+    if not times:
+        return 0.0
+    return max(Counter(int(t // window) for t in times).values()) / window
+
+
+def report(stand_in: StandIn, actions: Counter, scenarios: Counter, duration: float, seed: int) -> Dict[str, Any]:
+    counts = Counter(op for _, op in stand_in.log)
+    cloud_times = [t for t, op in stand_in.log if not op.startswith(("LOCAL ", "MATTER "))]
+    total_actions = sum(actions.values())
+    return {
+        "seed": seed,
+        "simulated_s": duration,
+        "requests": dict(sorted(counts.items())),
+        "cloud_requests": len(cloud_times),
+        "cloud_requests_per_day": round(len(cloud_times) / duration * 86400, 1) if duration else 0.0,
+        "peak_rps_1s": peak(cloud_times, 1),
+        "peak_rps_1m": round(peak(cloud_times, 60), 3),
+        "peak_rps_1h": round(peak(cloud_times, 3600), 4),
+        "scenarios": dict(sorted(scenarios.items())),
+        "actions": {name: {"count": n, "share": round(n / total_actions, 4)} for name, n in sorted(actions.items())},
+    }
+
+
+def simulate(duration: float, seed: int, verbose: bool = False) -> Dict[str, Any]:
+    clock = scenario.VirtualClock()
+    stand_in = StandIn(clock)
+    actions: Counter = Counter()
+    scenarios: Counter = Counter()
+
+    def on_action(action: str, backend: str) -> None:
+        if action == "scenario":
+            scenarios[backend] += 1
+        else:
+            actions[action] += 1
+
+    scenario.clock = clock
+    scenario.rng = random.Random(seed)
+    scenario.BASE_URL = SIM_CLOUD_URL
+    for session, url in ((scenario.session, SIM_CLOUD_URL), (scenario.local_session, SIM_BULB_URL)):
+        session.mount(url, stand_in)
+        # nothing leaves the process: skip requests' per-call scan of the proxy environment
+        session.trust_env = False
+    scenario._local_base_url = lambda: SIM_BULB_URL
+    scenario._exec_chiptool = stand_in.chiptool
+    scenario.state_mirror = scenario.StateMirror(scenario.STATE_MIRROR_TTL)
+    scenario.action_observer = on_action
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        while clock.monotonic() < duration:
+            clock.sleep(scenario.cycle())
+    scenario.action_observer = None
+    return report(stand_in, actions, scenarios, clock.monotonic(), seed)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Time-compressed, seeded run of one household against an in-process cloud.")
+    parser.add_argument("--simulate", type=parse_duration, default=parse_duration("1d"), help="simulated span, e.g. 12h, 30d")
+    parser.add_argument("--seed", type=int, default=None, help="same seed, same run (default: random, printed)")
+    parser.add_argument("--out", default=None, help="also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="keep scenario.py's per-step output")
+    args = parser.parse_args(argv)
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+
+    started = time.perf_counter()
+    result = simulate(args.simulate, seed, args.verbose)
+    elapsed = time.perf_counter() - started
+
+    days = result["simulated_s"] / 86400
+    print(f"[SIM] {days:g} simulated day(s), seed={seed}, ran in {elapsed:.1f}s")
+    print(f"{'request':<28}{'count':>10}{'per day':>10}")
+    for op, n in result["requests"].items():
+        print(f"{op:<28}{n:>10}{n / days:>10.1f}")
+    print(f"[SIM] cloud peak: {result['peak_rps_1s']:g} req/s (1 s), {result['peak_rps_1m']:g} req/s (1 min), "
+          f"{result['peak_rps_1h']:g} req/s (1 h)")
+    print(f"[SIM] scenarios by backend: {result['scenarios']}")
+    print(f"{'action':<28}{'count':>10}{'share':>10}")
+    for name, row in result["actions"].items():
+        print(f"{name:<28}{row['count']:>10}{row['share'] * 100:>9.1f}%")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"[SIM] report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
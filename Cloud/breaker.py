@@ -0,0 +1,120 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    # closed: calls go through and their outcomes fill a rolling time window.
+    # open: too many of them failed (or were slow); calls are refused for open_seconds.
+    # half_open: a few probe calls are let through; one good probe closes, one bad probe re-opens.
+    def __init__(self, name: str, window: float = 30.0, min_requests: int = 5, error_rate: float = 0.5,
+                 slow_call: float = 2.0, slow_rate: float = 0.8, open_seconds: float = 15.0, half_open_probes: int = 1):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self._failed = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _prune_locked(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, failed, slow = self._outcomes.popleft()
+            self._failed -= failed
+            self._slow -= slow
+
+    def _reset_locked(self) -> None:
+        self._outcomes.clear()
+        self._failed = self._slow = 0
+
+    def _trip_locked(self, now: float, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._reset_locked()
+        logger.warning("Circuit for %s opened (%s), refusing calls for %.0fs", self.name, reason, self.open_seconds)
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    return False
+                self._probes += 1
+            return True
+
+    def record(self, ok: bool, latency: float) -> None:
+        slow = latency >= self.slow_call
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if ok and not slow:
+                    self.state = CLOSED
+                    self._reset_locked()
+                    logger.info("Circuit for %s closed again", self.name)
+                else:
+                    self._trip_locked(now, "probe failed" if not ok else "probe too slow")
+                return
+            if self.state == OPEN:
+                # a call started before the circuit opened
+                return
+            self._outcomes.append((now, not ok, slow))
+            self._failed += not ok
+            self._slow += slow
+            self._prune_locked(now)
+            n = len(self._outcomes)
+            if n < self.min_requests:
+                return
+            if self._failed / n >= self.error_rate:
+                self._trip_locked(now, f"{self._failed}/{n} calls failed")
+            elif self._slow / n >= self.slow_rate:
+                self._trip_locked(now, f"{self._slow}/{n} calls slower than {self.slow_call}s")
+
+    def cancel(self) -> None:
+        # an allowed call that never reached the device: neither outcome, but give back its probe
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def retry_after(self) -> int:
+        # whole seconds, as sent in the Retry-After header
+        with self._lock:
+            if self.state == OPEN:
+                return max(1, math.ceil(self._opened_at + self.open_seconds - time.monotonic()))
+            return 1
+
+
+class LatencyWindow:
+    # Last `size` successful call latencies, for percentile estimates.
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[max(0, math.ceil(pct / 100 * len(samples)) - 1)]
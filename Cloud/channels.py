@@ -0,0 +1,166 @@
+import json
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+import simple_websocket
+
+logger = logging.getLogger(__name__)
+
+# bulb HTTP route -> command name sent in its place; the bulb replays the command against the same route
+ROUTE_OPS: Dict[Tuple[str, str], str] = {
+    ("GET", "/status"): "status",
+    ("POST", "/on"): "on",
+    ("POST", "/off"): "off",
+    ("POST", "/brightness"): "brightness",
+    ("POST", "/color"): "color",
+    ("POST", "/state"): "state",
+    ("POST", "/effect"): "effect",
+    ("POST", "/effect/stop"): "effect_stop",
+}
+# request headers worth forwarding in a command frame, and response headers the bulb acks back
+COMMAND_HEADERS = ("If-Match", "If-None-Match", "X-Request-Id")
+ACK_HEADERS = ("ETag",)
+
+
+class ChannelClosed(requests.ConnectionError):
+    # The channel died before the ack. Commands set absolute state (on, color=X...), so
+    # replaying one over HTTP is harmless even if the bulb did apply it.
+    pass
+
+
+class ChannelTimeout(requests.Timeout):
+    pass
+
+
+class BulbChannel:
+    # One bulb's outbound WebSocket. Commands carry an id; the bulb acks each one with the same id.
+    # Keepalive is the socket's: a server opened with ping_interval drops a bulb that stops answering pings.
+    def __init__(self, device_id: str, ws: simple_websocket.Server):
+        self.device_id = device_id
+        self.ws = ws
+        self._pending: Dict[int, Future] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        # request threads share the connection: one frame at a time
+        self._send_lock = threading.Lock()
+        self.closed = False
+
+    def call(self, op: str, args: Optional[Any], headers: Optional[Dict[str, str]], timeout: float) -> requests.Response:
+        fut: Future = Future()
+        with self._lock:
+            if self.closed:
+                raise ChannelClosed(f"command channel of '{self.device_id}' is closed")
+            command_id = self._next_id
+            self._next_id += 1
+            self._pending[command_id] = fut
+        frame: Dict[str, Any] = {"id": command_id, "op": op}
+        if args is not None:
+            frame["args"] = args
+        forwarded = {k: v for k, v in (headers or {}).items() if k in COMMAND_HEADERS}
+        if forwarded:
+            frame["headers"] = forwarded
+        try:
+            with self._send_lock:
+                self.ws.send(json.dumps(frame, separators=(",", ":")))
+        except (OSError, simple_websocket.ConnectionClosed) as e:
+            with self._lock:
+                self._pending.pop(command_id, None)
+            self.close()
+            raise ChannelClosed(f"command channel of '{self.device_id}' failed: {e}")
+        try:
+            ack = fut.result(timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._pending.pop(command_id, None)
+            raise ChannelTimeout(f"no ack from '{self.device_id}' for {op} within {timeout}s")
+        return ack_to_response(ack, f"channel://{self.device_id}/{op}")
+
+    def serve(self) -> None:
+        # Reader loop, run on the thread that accepted the upgrade; returns when the channel closes.
+        try:
+            while True:
+                text = self.ws.receive()
+                try:
+                    ack = json.loads(text)
+                    fut = self._pending_pop(ack["id"])
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("Malformed frame from %s: %.200s", self.device_id, text)
+                    continue
+                if fut and not fut.done():
+                    fut.set_result(ack)
+        except simple_websocket.ConnectionClosed as e:
+            logger.info("Command channel of %s dropped: %s", self.device_id, e)
+        finally:
+            self.close()
+
+    def _pending_pop(self, command_id: int) -> Optional[Future]:
+        with self._lock:
+            return self._pending.pop(command_id, None)
+
+    def close(self) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        try:
+            self.ws.close()
+        except (OSError, simple_websocket.ConnectionClosed):
+            pass
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(ChannelClosed(f"command channel of '{self.device_id}' closed before the ack"))
+
+
+def ack_to_response(ack: Dict[str, Any], url: str) -> requests.Response:
+    # Dress the ack up as the HTTP response the route would have returned, so callers don't care.
+    resp = requests.Response()
+    resp.status_code = int(ack.get("status", 502))
+    resp.url = url
+    resp.reason = "OK" if resp.status_code < 400 else "Error"
+    body = ack.get("body")
+    if isinstance(body, str):
+        resp._content = body.encode()
+        resp.headers["Content-Type"] = "text/plain; charset=utf-8"
+    elif body is not None:
+        resp._content = json.dumps(body).encode()
+        resp.headers["Content-Type"] = "application/json"
+    else:
+        resp._content = b""
+    for name in ACK_HEADERS:
+        value = (ack.get("headers") or {}).get(name)
+        if value:
+            resp.headers[name] = value
+    return resp
+
+
+class ChannelRegistry:
+    def __init__(self):
+        self._channels: Dict[str, BulbChannel] = {}
+        self._lock = threading.Lock()
+
+    def register(self, channel: BulbChannel) -> None:
+        with self._lock:
+            previous = self._channels.get(channel.device_id)
+            self._channels[channel.device_id] = channel
+        if previous:
+            # the bulb reconnected before we noticed the old connection was gone
+            previous.close()
+        logger.info("Command channel of %s registered", channel.device_id)
+
+    def unregister(self, channel: BulbChannel) -> None:
+        with self._lock:
+            if self._channels.get(channel.device_id) is channel:
+                del self._channels[channel.device_id]
+
+    def get(self, device_id: str) -> Optional[BulbChannel]:
+        with self._lock:
+            channel = self._channels.get(device_id)
+        return channel if channel and not channel.closed else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._channels)
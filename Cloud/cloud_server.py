@@ -1,192 +1,986 @@
-    import os
-    import re
-    import json
-    import uuid
-    import logging
-    from typing import Any, Dict, Optional, Tuple
-    from datetime import datetime, timedelta
-
-    import requests
-    from flask import Flask, request, jsonify, g
-    from urllib3.util import Retry
-    from requests.adapters import HTTPAdapter
-
-
-    BULB_HOST = os.getenv("BULB_HOST", "has-loved-practitioners-claims.trycloudflare.com")
-    BULB_BASE_URL = f"https://{BULB_HOST}"
-    VERIFY_TLS = os.getenv("VERIFY_TLS", "true").lower() != "false"
-    API_KEY = os.getenv("API_KEY")
-    REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5"))
-    MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", "2048"))
-    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "60"))
-
-
-    app = Flask(__name__)
-    app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
-    logger = logging.getLogger(__name__)
-
-
+import os
+import re
+import json
+import hashlib
+import uuid
+import logging
+import threading
+import time
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+import simple_websocket
+from flask import Flask, Response, request, jsonify, g
+from urllib3.util import Retry
+from requests.adapters import HTTPAdapter
+from werkzeug.http import unquote_etag
+
+from breaker import CircuitBreaker, LatencyWindow
+from channels import ROUTE_OPS, BulbChannel, ChannelClosed, ChannelRegistry
+from coalesce import WriteCoalescer
+from idempotency import make_store
+from liveness import LivenessTable
+from metrics import CONTENT_TYPE, Registry, SpanRecorder
+
+
+BULB_HOST = os.getenv("BULB_HOST", "has-loved-practitioners-claims.trycloudflare.com")
+# Several bulbs: DEVICES="kitchen=host-a.example,living=host-b.example" and/or DEVICES_FILE={"id": "host"} JSON.
+# Without either, the single bulb at BULB_HOST is registered as DEVICE_ID.
+# A host of "channel" means the bulb is only reachable over the command channel it opens itself.
+# That channel lives in the one worker process that accepted it: with several workers (e.g. the
+# shared SQLite idempotency store), every other worker sees such a bulb as offline.
+DEVICES = os.getenv("DEVICES", "")
+DEVICES_FILE = os.getenv("DEVICES_FILE")
+DEVICE_POOL_SIZE = int(os.getenv("DEVICE_POOL_SIZE", "4"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "16"))
+VERIFY_TLS = os.getenv("VERIFY_TLS", "true").lower() != "false"
+API_KEY = os.getenv("API_KEY")
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5"))
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", "2048"))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "60"))
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", "/tmp/cloud_idempotency.sqlite3")
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_SWEEP_SECONDS = float(os.getenv("IDEMPOTENCY_SWEEP_SECONDS", "30"))
+# how long a duplicate request waits for the in-flight original before giving up with 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", str(REQUEST_TIMEOUT * 4)))
+DEVICE_ID = os.getenv("DEVICE_ID", "default")
+STATUS_CACHE_TTL_SECONDS = float(os.getenv("STATUS_CACHE_TTL_SECONDS", "2"))
+STATUS_CACHE_STALE_SECONDS = float(os.getenv("STATUS_CACHE_STALE_SECONDS", "30"))
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+EVENT_KEEPALIVE_SECONDS = float(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+# a bulb is treated as offline after missing this many heartbeats in a row
+HEARTBEAT_MISSED_LIMIT = int(os.getenv("HEARTBEAT_MISSED_LIMIT", "3"))
+# assumed heartbeat period when the bulb does not announce one (older firmware)
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "60"))
+# per-device circuit breaker over a rolling window of bulb calls
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "30"))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "2"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "15"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+# hedged GETs: a second attempt goes out when the first has not answered by the device's p95
+HEDGE_GETS = os.getenv("HEDGE_GETS", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.05"))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "16"))
+# a bulb's command channel is pinged every half of this and dropped when a ping goes unanswered
+CHANNEL_IDLE_SECONDS = float(os.getenv("CHANNEL_IDLE_SECONDS", "90"))
+# > 0: PATCHes for the same device arriving within this window go to the bulb as one merged write
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "0"))
+METRICS_SPAN_BUFFER = int(os.getenv("METRICS_SPAN_BUFFER", "2048"))
+
+
+app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+logger = logging.getLogger(__name__)
+
+registry = Registry()
+http_latency = registry.histogram(
+    "cloud_http_request_duration_seconds", "Time spent handling a request", ("method", "route", "status"))
+upstream_latency = registry.histogram(
+    "cloud_upstream_request_duration_seconds", "Bulb call latency, retries included",
+    ("device", "method", "path", "status", "transport"))
+upstream_retries = registry.counter(
+    "cloud_upstream_retries_total", "Bulb calls retried by the HTTP adapter", ("method", "reason"))
+circuit_rejections = registry.counter(
+    "cloud_circuit_rejections_total", "Bulb calls refused by an open circuit", ("device",))
+hedged_requests = registry.counter(
+    "cloud_hedged_requests_total", "Hedged bulb GETs, by which attempt answered first", ("device", "winner"))
+idempotency_requests = registry.counter(
+    "cloud_idempotency_requests_total", "Requests carrying an Idempotency-Key, by outcome", ("result",))
+status_cache_requests = registry.counter(
+    "cloud_status_cache_requests_total", "Status reads by cache outcome", ("result",))
+coalesced_writes = registry.histogram(
+    "cloud_coalesced_writes", "PATCH requests merged into each bulb write", ("device",),
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+spans = SpanRecorder(METRICS_SPAN_BUFFER)
+# X-Request-Id of the request being served; forwarded to the bulb so both sides' spans line up
+current_request_id: ContextVar[Optional[str]] = ContextVar("current_request_id", default=None)
+
+
+class CountingRetry(Retry):
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        retry = super().increment(method, url, response, error, *args, **kwargs)
+        # only reached when another attempt will be made
+        reason = str(response.status) if response is not None else type(error).__name__
+        upstream_retries.inc(method or "-", reason)
+        return retry
+
+
+def make_session() -> requests.Session:
     session = requests.Session()
-    retries = Retry(
+    retries = CountingRetry(
         total=3,
         backoff_factor=0.25,
         status_forcelist=[429, 500, 502, 503, 504],
         allowed_methods={"GET", "POST"},
     )
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-
-
-    HEX_COLOR_RE = re.compile(r"^#([0-9a-fA-F]{6})$")
-
-    def is_valid_hex_color(value: Any) -> bool:
-        return isinstance(value, str) and HEX_COLOR_RE.fullmatch(value) is not None
-
-    def parse_bool(value: Any) -> Optional[bool]:
-        if isinstance(value, bool):
-            return value
-        if isinstance(value, str):
-            if value.lower() in {"true", "1", "yes", "on"}:
-                return True
-            if value.lower() in {"false", "0", "no", "off"}:
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=1, pool_maxsize=DEVICE_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class Device:
+    def __init__(self, device_id: str, host: str):
+        self.device_id = device_id
+        if host == "channel":
+            self.base_url = None
+        else:
+            self.base_url = host.rstrip("/") if "://" in host else f"https://{host}"
+        self.session = make_session()
+        # Flipped to False the first time the bulb answers /state with 404/405 (older firmware).
+        self.state_route_supported = True
+        self.breaker = CircuitBreaker(
+            device_id,
+            window=BREAKER_WINDOW_SECONDS,
+            min_requests=BREAKER_MIN_REQUESTS,
+            error_rate=BREAKER_ERROR_RATE,
+            slow_call=BREAKER_SLOW_SECONDS,
+            slow_rate=BREAKER_SLOW_RATE,
+            open_seconds=BREAKER_OPEN_SECONDS,
+            half_open_probes=BREAKER_HALF_OPEN_PROBES,
+        )
+        self.get_latency = LatencyWindow()
+
+# /cloud/<name> routes of their own: a device with one of these ids could not be reached
+RESERVED_DEVICE_IDS = ("batch", "channel", "events")
+
+def load_device_hosts() -> Dict[str, str]:
+    hosts: Dict[str, str] = {}
+    if DEVICES_FILE:
+        with open(DEVICES_FILE) as f:
+            hosts.update(json.load(f))
+    for item in filter(None, (x.strip() for x in DEVICES.split(","))):
+        device_id, _, host = item.partition("=")
+        if not host:
+            raise ValueError(f"Invalid DEVICES entry '{item}', expected 'id=host'")
+        hosts[device_id.strip()] = host.strip()
+    if not hosts:
+        hosts[DEVICE_ID] = BULB_HOST
+    for device_id in hosts:
+        if device_id in RESERVED_DEVICE_IDS:
+            raise ValueError(f"Device id '{device_id}' is reserved, pick another one")
+    return hosts
+
+devices: Dict[str, Device] = {device_id: Device(device_id, host) for device_id, host in load_device_hosts().items()}
+if DEVICE_ID not in devices:
+    DEVICE_ID = next(iter(devices))
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+
+
+HEX_COLOR_RE = re.compile(r"^#([0-9a-fA-F]{6})$")
+
+def is_valid_hex_color(value: Any) -> bool:
+    return isinstance(value, str) and HEX_COLOR_RE.fullmatch(value) is not None
+
+def parse_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        if value.lower() in {"true", "1", "yes", "on"}:
+            return True
+        if value.lower() in {"false", "0", "no", "off"}:
+            return False
+    return None
+
+idempotency = make_store(
+    IDEMPOTENCY_BACKEND,
+    ttl=IDEMPOTENCY_TTL_SECONDS,
+    max_entries=IDEMPOTENCY_MAX_ENTRIES,
+    sweep_interval=IDEMPOTENCY_SWEEP_SECONDS,
+    db_path=IDEMPOTENCY_DB_PATH,
+    inflight_ttl=IDEMPOTENCY_WAIT_SECONDS,
+)
+
+def idempotency_lookup(key: str) -> Optional[Tuple[Dict[str, Any], int]]:
+    return idempotency.get(key)
+
+def idempotency_store(key: str, body: Dict[str, Any], status: int) -> None:
+    idempotency.put(key, body, status)
+
+def json_response(body: Dict[str, Any], status: int):
+    resp = jsonify(body)
+    resp.status_code = status
+    if body.get("retry_after"):
+        resp.headers["Retry-After"] = str(body["retry_after"])
+    return resp
+
+def idempotent_replay(cached: Tuple[Dict[str, Any], int]):
+    body, status = cached
+    body = dict(body)
+    body["idempotent"] = True
+    body["request_id"] = g.request_id
+    return jsonify(body), status
+
+def run_idempotent(key: Optional[str], fn):
+    # fn() -> (body, status); only 200 results are remembered
+    if not key:
+        return json_response(*fn())
+
+    cached = idempotency_lookup(key)
+    if cached:
+        idempotency_requests.inc("hit")
+        return idempotent_replay(cached)
+    claimed = idempotency.claim(key)
+    if not claimed:
+        # same key already in flight (this or another worker): share its result
+        cached = idempotency.wait(key, IDEMPOTENCY_WAIT_SECONDS)
+        if cached:
+            idempotency_requests.inc("shared")
+            return idempotent_replay(cached)
+        # the original failed and let go of the key without a result: this request runs the write itself
+        claimed = idempotency.claim(key)
+    if not claimed:
+        idempotency_requests.inc("conflict")
+        return jsonify({"error": "conflict", "message": "A request with this Idempotency-Key is still in progress", "request_id": g.request_id}), 409
+    idempotency_requests.inc("miss")
+    try:
+        body, status = fn()
+        if status == 200:
+            idempotency_store(key, body, status)
+        return json_response(body, status)
+    finally:
+        idempotency.release(key)
+
+
+class StatusCache:
+    # device_id -> (monotonic fetch time, status body, bulb ETag or None)
+    def __init__(self, ttl: float, stale: float):
+        self.ttl = ttl
+        self.stale = stale
+        self._entries: Dict[str, Tuple[float, Dict[str, Any], Optional[str]]] = {}
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, device_id: str) -> Tuple[Optional[Dict[str, Any]], str, Optional[str]]:
+        # Returns (body, "HIT" | "STALE" | "MISS", etag); STALE bodies must be revalidated by the caller.
+        if self.ttl <= 0:
+            return None, "MISS", None
+        with self._lock:
+            entry = self._entries.get(device_id)
+        if not entry:
+            return None, "MISS", None
+        ts, body, etag = entry
+        age = time.monotonic() - ts
+        if age <= self.ttl:
+            return body, "HIT", etag
+        if age <= self.ttl + self.stale:
+            return body, "STALE", etag
+        return None, "MISS", None
+
+    def peek(self, device_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        with self._lock:
+            entry = self._entries.get(device_id)
+        return (entry[1], entry[2]) if entry else (None, None)
+
+    def put(self, device_id: str, body: Dict[str, Any], etag: Optional[str] = None) -> None:
+        with self._lock:
+            self._entries[device_id] = (time.monotonic(), dict(body), etag)
+
+    def touch(self, device_id: str, etag: Optional[str] = None) -> None:
+        # upstream answered 304 (or a heartbeat vouched for it): what we hold is still current
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry:
+                self._entries[device_id] = (time.monotonic(), entry[1], etag or entry[2])
+
+    def invalidate(self, device_id: str) -> None:
+        with self._lock:
+            self._entries.pop(device_id, None)
+
+    def begin_refresh(self, device_id: str) -> bool:
+        with self._lock:
+            if device_id in self._refreshing:
                 return False
+            self._refreshing.add(device_id)
+            return True
+
+    def end_refresh(self, device_id: str) -> None:
+        with self._lock:
+            self._refreshing.discard(device_id)
+
+status_cache = StatusCache(STATUS_CACHE_TTL_SECONDS, STATUS_CACHE_STALE_SECONDS)
+
+
+class EventBus:
+    # Ring buffer of state events; ids are global and increasing so clients can resume with Last-Event-ID.
+    def __init__(self, size: int):
+        self._events: deque = deque(maxlen=size)
+        self._versions: Dict[str, int] = {}
+        self._next_id = 1
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def publish(self, device_id: str, state: Dict[str, Any], source: str) -> Dict[str, Any]:
+        with self._cond:
+            version = self._versions.get(device_id, 0) + 1
+            self._versions[device_id] = version
+            event = {"id": self._next_id, "device_id": device_id, "version": version, "source": source, "state": state}
+            self._next_id += 1
+            self._events.append(event)
+            self._cond.notify_all()
+        return event
+
+    def since(self, last_id: int) -> Tuple[list, bool]:
+        # Returns (events after last_id, gap) where gap means some were already dropped from the buffer,
+        # or last_id was never handed out here (ids restart at 1 with the process).
+        with self._cond:
+            events = [e for e in self._events if e["id"] > last_id]
+            oldest = self._events[0]["id"] if self._events else self._next_id
+            return events, last_id + 1 < oldest or last_id >= self._next_id
+
+    def wait(self, last_id: int, timeout: float) -> list:
+        with self._cond:
+            self._cond.wait_for(lambda: self._next_id - 1 > last_id, timeout=timeout)
+        return self.since(last_id)[0]
+
+    @property
+    def last_id(self) -> int:
+        with self._cond:
+            return self._next_id - 1
+
+events = EventBus(EVENT_BUFFER_SIZE)
+liveness = LivenessTable()
+channels = ChannelRegistry()
+
+registry.gauge("cloud_devices", "Registered bulbs", lambda: len(devices))
+registry.gauge("cloud_devices_online", "Bulbs whose heartbeats are on time", lambda: liveness.online_count())
+registry.gauge("cloud_circuit_open", "1 while the device's circuit refuses calls (0.5 half-open)",
+               lambda: {(d,): {"closed": 0, "half_open": 0.5, "open": 1}[dev.breaker.state] for d, dev in devices.items()},
+               ("device",))
+registry.gauge("cloud_command_channels", "Bulbs connected over their command channel", lambda: len(channels))
+registry.gauge("cloud_pending_writes", "Devices with a coalesced write waiting to be flushed", lambda: len(coalescer))
+registry.gauge("cloud_status_cache_entries", "Bulb states held in the status cache", lambda: len(status_cache))
+registry.gauge("cloud_idempotency_entries", "Remembered idempotent results", lambda: len(idempotency))
+registry.gauge("cloud_event_buffer_events", "Events held for SSE resume", lambda: len(events))
+registry.gauge("cloud_span_buffer_spans", "Timing spans held for /metrics/spans", lambda: len(spans))
+
+
+@app.before_request
+def before_request():
+    g.started = time.perf_counter()
+    g.started_wall = time.time()
+    g.request_id = request.headers.get("X-Request-Id", str(uuid.uuid4()))
+    current_request_id.set(g.request_id)
+    if API_KEY:
+        provided = request.headers.get("X-API-Key")
+        if not provided or provided != API_KEY:
+            return jsonify({"error": "unauthorized", "message": "Missing or invalid API key", "request_id": g.request_id}), 401
+
+@app.after_request
+def after_request(resp):
+    resp.headers["X-Request-Id"] = g.get("request_id", "-")
+    if "started" in g:
+        elapsed = time.perf_counter() - g.started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_latency.observe(elapsed, request.method, route, resp.status_code)
+        spans.record(g.request_id, "request", g.started_wall, elapsed,
+                     method=request.method, route=route, status=resp.status_code)
+    return resp
+
+@app.errorhandler(400)
+def bad_request(e):
+    return jsonify({"error": "bad_request", "message": str(e), "request_id": g.request_id}), 400
+
+@app.errorhandler(404)
+def not_found(e):
+    return jsonify({"error": "not_found", "message": "Route not found", "request_id": g.request_id}), 404
+
+@app.errorhandler(500)
+def server_error(e):
+    return jsonify({"error": "server_error", "message": str(e), "request_id": g.request_id}), 500
+
+
+class DeviceOffline(requests.ConnectionError):
+    pass
+
+class ChannelUnavailable(DeviceOffline):
+    # channel-only bulb with no channel open (e.g. reconnecting): offline, not failing
+    pass
+
+class CircuitOpen(requests.ConnectionError):
+    def __init__(self, device_id: str, retry_after: int):
+        super().__init__(f"Device '{device_id}' is failing, calls are suspended for {retry_after}s")
+        self.retry_after = retry_after
+
+
+def bulb_request(method: str, path: str, device_id: Optional[str] = None, json_body: Optional[Dict[str, Any]] = None,
+                 headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    device = devices[device_id or DEVICE_ID]
+    channel = channels.get(device.device_id)
+    op = ROUTE_OPS.get((method, path))
+    if channel is None and device.base_url is None:
+        raise ChannelUnavailable(f"Device '{device.device_id}' has no open command channel")
+    if channel is None and liveness.is_offline(device.device_id):
+        # heartbeats stopped: fail now instead of waiting out timeout x retries
+        raise DeviceOffline(f"Device '{device.device_id}' missed its heartbeats and is considered offline")
+    if not device.breaker.allow():
+        circuit_rejections.inc(device.device_id)
+        raise CircuitOpen(device.device_id, device.breaker.retry_after())
+    request_id = current_request_id.get()
+    if request_id:
+        headers = {**(headers or {}), "X-Request-Id": request_id}
+    started = time.time()
+    t0 = time.perf_counter()
+    status = "error"
+    transport = "http"
+    try:
+        r = None
+        if channel is not None and op:
+            # one frame on the bulb's own connection: no handshake, no tunnel hop
+            try:
+                r = channel.call(op, json_body, headers, REQUEST_TIMEOUT)
+                transport = "channel"
+            except ChannelClosed as e:
+                logger.info("Falling back to HTTP for %s: %s", device.device_id, e)
+        if r is None:
+            if device.base_url is None:
+                status = "offline"
+                raise ChannelUnavailable(f"Device '{device.device_id}' lost its command channel")
+            r = device.session.request(method, f"{device.base_url}{path}", json=json_body, headers=headers,
+                                       verify=VERIFY_TLS, timeout=REQUEST_TIMEOUT)
+        status = r.status_code
+        return r
+    finally:
+        elapsed = time.perf_counter() - t0
+        if status == "offline":
+            # the channel dropped under the call: the bulb is away, not failing
+            device.breaker.cancel()
+        else:
+            # 4xx means the bulb is up and answering; only transport errors, 5xx and 429 count against it
+            ok = status != "error" and status < 500 and status != 429
+            device.breaker.record(ok, elapsed)
+            if ok and method == "GET":
+                device.get_latency.add(elapsed)
+        upstream_latency.observe(elapsed, device.device_id, method, path, status, transport)
+        spans.record(request_id, "upstream", started, elapsed,
+                     device=device.device_id, method=method, path=path, status=status, transport=transport)
+
+def bulb_post(path: str, json_body: Optional[Dict[str, Any]] = None, device_id: Optional[str] = None,
+              headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    return bulb_request("POST", path, device_id, json_body, headers)
+
+def bulb_get(path: str, device_id: Optional[str] = None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+    device = devices[device_id or DEVICE_ID]
+    delay = device.get_latency.percentile(HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES) if HEDGE_GETS else None
+    if delay is None or device.breaker.state != "closed" or channels.get(device.device_id):
+        return bulb_request("GET", path, device.device_id, headers=headers)
+    return hedged(lambda: bulb_request("GET", path, device.device_id, headers=headers),
+                  device.device_id, max(delay, HEDGE_MIN_DELAY_SECONDS))
+
+def hedged(call, device_id: str, delay: float) -> requests.Response:
+    # Only for idempotent reads: first attempt now, second one if the first is still out after `delay`.
+    # The first good answer wins; the other attempt finishes in the background.
+    attempts = [hedge_executor.submit(contextvars.copy_context().run, call)]
+    done, _ = wait(attempts, timeout=delay)
+    if not done:
+        attempts.append(hedge_executor.submit(contextvars.copy_context().run, call))
+    pending = set(attempts)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                if len(attempts) > 1:
+                    hedged_requests.inc(device_id, "primary" if fut is attempts[0] else "hedge")
+                return fut.result()
+            error = fut.exception()
+    raise error
+
+
+class PreconditionFailed(Exception):
+    pass
+
+
+def apply_to_bulb_per_field(changes: Dict[str, Any], device_id: str) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    if "enabled" in changes:
+        r = bulb_post("/on" if changes["enabled"] else "/off", device_id=device_id)
+        r.raise_for_status()
+        results["enabled"] = changes["enabled"]
+
+    if "brightness" in changes:
+        r = bulb_post("/brightness", json_body={"level": changes["brightness"]}, device_id=device_id)
+        r.raise_for_status()
+        results["brightness"] = changes["brightness"]
+
+    if "color" in changes:
+        r = bulb_post("/color", json_body={"color": changes["color"]}, device_id=device_id)
+        r.raise_for_status()
+        results["color"] = changes["color"]
+    return results
+
+def apply_fields_to_bulb(changes: Dict[str, Any], device_id: str,
+                         if_match: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[str]]:
+    # Returns (applied, full new state, ETag); the last two are only known when /state is available.
+    device = devices[device_id]
+    if device.state_route_supported:
+        r = bulb_post("/state", json_body=changes, device_id=device_id,
+                      headers={"If-Match": if_match} if if_match else None)
+        if r.status_code in (404, 405):
+            logger.info("Bulb %s has no /state route, falling back to per-field routes", device_id)
+            device.state_route_supported = False
+        elif r.status_code == 412:
+            raise PreconditionFailed(r.headers.get("ETag"))
+        else:
+            r.raise_for_status()
+            return dict(changes), r.json(), r.headers.get("ETag")
+    if if_match:
+        # older firmware has no versions, so the precondition can never hold
+        raise PreconditionFailed(None)
+    return apply_to_bulb_per_field(changes, device_id), None, None
+
+def apply_effect_to_bulb(effect: Any, device_id: str) -> Any:
+    if effect == "stop":
+        r = bulb_post("/effect/stop", device_id=device_id)
+        r.raise_for_status()
+        return "stop"
+    r = bulb_post("/effect", json_body=effect, device_id=device_id)
+    r.raise_for_status()
+    return {"mode": effect.get("mode", "step"), "loop": effect.get("loop", 1), "keyframes": len(effect["keyframes"])}
+
+def apply_to_bulb(changes: Dict[str, Any], device_id: str,
+                  if_match: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[str]]:
+    fields = {k: v for k, v in changes.items() if k != "effect"}
+    results: Dict[str, Any] = {}
+    state, etag = None, None
+    if fields:
+        results, state, etag = apply_fields_to_bulb(fields, device_id, if_match)
+    if "effect" in changes:
+        results["effect"] = apply_effect_to_bulb(changes["effect"], device_id)
+    return results, state, etag
+
+
+def validate_effect(effect: Any) -> Optional[str]:
+    # Shape check only; the bulb enforces its own limits on keyframes, loops and durations.
+    if effect == "stop":
         return None
-
-    _idempo: Dict[str, Tuple[datetime, Dict[str, Any], int]] = {}
-
-    def idempotency_lookup(key: str) -> Optional[Tuple[Dict[str, Any], int]]:
-        now = datetime.utcnow()
-        entry = _idempo.get(key)
-        if not entry:
-            return None
-        ts, body, status = entry
-        if now - ts > timedelta(seconds=IDEMPOTENCY_TTL_SECONDS):
-            _idempo.pop(key, None)
-            return None
-        return body, status
-
-    def idempotency_store(key: str, body: Dict[str, Any], status: int) -> None:
-        _idempo[key] = (datetime.utcnow(), body, status)
-
-
-    @app.before_request
-    def before_request():
-        g.request_id = request.headers.get("X-Request-Id", str(uuid.uuid4()))
-        if API_KEY:
-            provided = request.headers.get("X-API-Key")
-            if not provided or provided != API_KEY:
-                return jsonify({"error": "unauthorized", "message": "Missing or invalid API key", "request_id": g.request_id}), 401
-
-    @app.after_request
-    def after_request(resp):
-        resp.headers["X-Request-Id"] = g.get("request_id", "-")
-        return resp
-
-    @app.errorhandler(400)
-    def bad_request(e):
-        return jsonify({"error": "bad_request", "message": str(e), "request_id": g.request_id}), 400
-
-    @app.errorhandler(404)
-    def not_found(e):
-        return jsonify({"error": "not_found", "message": "Route not found", "request_id": g.request_id}), 404
-
-    @app.errorhandler(500)
-    def server_error(e):
-        return jsonify({"error": "server_error", "message": str(e), "request_id": g.request_id}), 500
-
-
-    def bulb_post(path: str, json_body: Optional[Dict[str, Any]] = None) -> requests.Response:
-        url = f"{BULB_BASE_URL}{path}"
-        return session.post(url, json=json_body, verify=VERIFY_TLS, timeout=REQUEST_TIMEOUT)
-
-    def bulb_get(path: str) -> requests.Response:
-        url = f"{BULB_BASE_URL}{path}"
-        return session.get(url, verify=VERIFY_TLS, timeout=REQUEST_TIMEOUT)
-
-
-    @app.route("/heartbeat", methods=["POST"])
-    def heartbeat():
-        data = request.get_json(silent=True) or {}
-        logger.info(f"Heartbeat received: {data}")
-        return jsonify({"status": "ok", "received": data, "request_id": g.request_id})
-
-    @app.route("/cloud", methods=["GET"])
-    def get_status():
+    if not isinstance(effect, dict):
+        return "'effect' must be an object or 'stop'"
+    keyframes = effect.get("keyframes")
+    if not isinstance(keyframes, list) or not keyframes:
+        return "'effect.keyframes' must be a non-empty list"
+    if effect.get("mode", "step") not in ("step", "fade"):
+        return "'effect.mode' must be 'step' or 'fade'"
+    loop = effect.get("loop", 1)
+    if isinstance(loop, bool) or not isinstance(loop, int) or loop < 0:
+        return "'effect.loop' must be a non-negative integer"
+    for kf in keyframes:
+        if not isinstance(kf, dict):
+            return "each keyframe must be an object"
+        if kf.get("color") is None and kf.get("brightness") is None:
+            return "each keyframe needs 'color' and/or 'brightness'"
+        if kf.get("color") is not None and not is_valid_hex_color(kf["color"]):
+            return "keyframe 'color' must be hex like '#RRGGBB'"
+        b = kf.get("brightness")
+        if b is not None and (isinstance(b, bool) or not isinstance(b, int) or not (0 <= b <= 100)):
+            return "keyframe 'brightness' must be an integer between 0 and 100"
+        d = kf.get("duration", 1.0)
+        if isinstance(d, bool) or not isinstance(d, (int, float)) or d <= 0:
+            return "keyframe 'duration' must be a positive number of seconds"
+    return None
+
+def validate_changes(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    enabled = payload.get("enabled")
+    brightness = payload.get("brightness")
+    color = payload.get("color")
+    effect = payload.get("effect")
+
+    if enabled is not None and parse_bool(enabled) is None:
+        return {}, "'enabled' must be boolean"
+    if brightness is not None:
         try:
-            r = bulb_get("/status")
-            r.raise_for_status()
-            body = r.json()
-            return jsonify({"request_id": g.request_id, **body}), 200
-        except Exception as e:
-            logger.exception("Failed to fetch status")
-            return jsonify({"error": "upstream_error", "message": str(e), "request_id": g.request_id}), 502
-
-    @app.route("/cloud", methods=["PATCH"])
-    def patch_cloud():
-        idem_key = request.headers.get("Idempotency-Key")
-        if idem_key:
-            cached = idempotency_lookup(idem_key)
-            if cached:
-                body, status = cached
-                body = dict(body)
-                body["idempotent"] = True
-                body["request_id"] = g.request_id
-                return jsonify(body), status
-
-        payload = request.get_json(silent=True) or {}
-        enabled = payload.get("enabled")
-        brightness = payload.get("brightness")
-        color = payload.get("color")
-
-        if enabled is not None and parse_bool(enabled) is None:
-            return jsonify({"error": "validation", "message": "'enabled' must be boolean"}), 400
-        if brightness is not None:
+            brightness = int(brightness)
+        except (TypeError, ValueError):
+            return {}, "'brightness' must be integer"
+        if not (0 <= brightness <= 100):
+            return {}, "'brightness' must be between 0 and 100"
+    if color is not None and not is_valid_hex_color(color):
+        return {}, "'color' must be hex like '#RRGGBB'"
+    if effect is not None:
+        error = validate_effect(effect)
+        if error:
+            return {}, error
+
+    if enabled is None and brightness is None and color is None and effect is None:
+        return {}, "Provide at least one of: enabled, brightness, color, effect"
+
+    changes: Dict[str, Any] = {}
+    if enabled is not None:
+        changes["enabled"] = parse_bool(enabled)
+    if brightness is not None:
+        changes["brightness"] = brightness
+    if color is not None:
+        changes["color"] = color.upper()
+    if effect is not None:
+        changes["effect"] = effect
+    return changes, None
+
+def apply_patch(device_id: str, changes: Dict[str, Any], request_id: str,
+                if_match: Optional[str] = None) -> Tuple[Dict[str, Any], int]:
+    try:
+        results, state, etag = apply_to_bulb(changes, device_id, if_match)
+        if "effect" in results:
+            # the bulb animates on its own from here; whatever we hold is already out of date
+            status_cache.invalidate(device_id)
+            state = None
+        elif state is not None:
+            status_cache.put(device_id, state, etag)
+        else:
+            # per-field routes (older firmware) don't return the state: read it back once here,
+            # so the client doesn't have to
+            status_cache.invalidate(device_id)
             try:
-                brightness = int(brightness)
-            except (TypeError, ValueError):
-                return jsonify({"error": "validation", "message": "'brightness' must be integer"}), 400
-            if not (0 <= brightness <= 100):
-                return jsonify({"error": "validation", "message": "'brightness' must be between 0 and 100"}), 400
-        if color is not None and not is_valid_hex_color(color):
-            return jsonify({"error": "validation", "message": "'color' must be hex like '#RRGGBB'"}), 400
-
-        if enabled is None and brightness is None and color is None:
-            return jsonify({"error": "validation", "message": "Provide at least one of: enabled, brightness, color"}), 400
-
-        results = {}
+                state, etag = fetch_status(device_id)
+            except Exception:
+                logger.warning("Could not read back the state of %s after a write", device_id, exc_info=True)
+                state, etag = None, None
+        events.publish(device_id, state or results, "patch")
+        # state/version/etag: the bulb right after this write (None while an effect plays)
+        return {"status": "ok", "applied": results, "state": state,
+                "version": state.get("version") if state else None, "etag": etag, "request_id": request_id}, 200
+
+    except PreconditionFailed as e:
+        return {"error": "precondition_failed", "message": "Bulb state changed since the given If-Match ETag",
+                "etag": e.args[0], "request_id": request_id}, 412
+
+    except DeviceOffline as e:
+        return {"error": "device_offline", "message": str(e), "request_id": request_id}, 503
+
+    except CircuitOpen as e:
+        return {"error": "circuit_open", "message": str(e), "retry_after": e.retry_after, "request_id": request_id}, 503
+
+    except requests.HTTPError as e:
+        # the bulb may have applied part of the change; don't serve what we had before
+        status_cache.invalidate(device_id)
+        logger.exception("Upstream returned error")
+        return {"error": "upstream_http_error", "message": str(e), "request_id": request_id}, 502
+    except Exception as e:
+        status_cache.invalidate(device_id)
+        logger.exception("Failed to apply changes")
+        return {"error": "upstream_error", "message": str(e), "request_id": request_id}, 502
+
+
+def flush_coalesced(device_id: str, changes: Dict[str, Any], merged: int) -> Tuple[Dict[str, Any], int]:
+    # Runs on the thread of the request that opened the batch, so the bulb sees its X-Request-Id.
+    coalesced_writes.observe(merged, device_id)
+    return apply_patch(device_id, changes, current_request_id.get() or "-")
+
+coalescer = WriteCoalescer(COALESCE_WINDOW_SECONDS, flush_coalesced)
+
+def apply_patch_coalesced(device_id: str, changes: Dict[str, Any], request_id: str,
+                          if_match: Optional[str] = None) -> Tuple[Dict[str, Any], int]:
+    if "effect" in changes or if_match:
+        # an effect is an action rather than a field value, and If-Match holds for one request only
+        return coalescer.run_exclusive(device_id, lambda: apply_patch(device_id, changes, request_id, if_match))
+    (body, status), merged = coalescer.submit(device_id, changes)
+    # every merged request answers with the outcome of the single write, under its own id
+    body = dict(body, request_id=request_id, coalesced=merged)
+    return body, status
+
+
+def unknown_device(device_id: str):
+    return jsonify({"error": "unknown_device", "message": f"No device '{device_id}'", "request_id": g.request_id}), 404
+
+
+def state_digest(state: Dict[str, Any]) -> str:
+    # same recipe as SmartBulb.digest() on the bulb
+    raw = f"{state.get('is_on')}|{state.get('brightness')}|{state.get('color')}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+def reconcile_cache(device_id: str, etag: Optional[str], digest: Optional[str]) -> None:
+    # A heartbeat says what state the bulb is in: keep our copy if it matches, drop it otherwise.
+    if not etag and not digest:
+        return
+    body, cached_etag = status_cache.peek(device_id)
+    if body is None:
+        return
+    if etag and cached_etag == etag:
+        status_cache.touch(device_id)
+    elif digest and not cached_etag and state_digest(body) == digest:
+        status_cache.touch(device_id, etag)
+    else:
+        status_cache.invalidate(device_id)
+
+@app.route("/heartbeat", methods=["POST"])
+def heartbeat():
+    data = request.get_json(silent=True) or {}
+    # older firmware only sends {"status": "alive"}: that is the default device
+    device_id = data.get("device_id") or DEVICE_ID
+    interval = data.get("interval", HEARTBEAT_INTERVAL_SECONDS)
+    if not isinstance(device_id, str) or isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval <= 0:
+        return jsonify({"error": "validation", "message": "'device_id' must be a string and 'interval' a positive number"}), 400
+    if device_id not in devices:
+        # only registered bulbs get a liveness entry: anyone can post here, the table must stay bounded
+        return unknown_device(device_id)
+    etag, digest = data.get("etag"), data.get("digest")
+    liveness.beat(
+        device_id,
+        ttl=min(float(interval), 3600.0) * HEARTBEAT_MISSED_LIMIT,
+        version=data.get("version"),
+        etag=etag,
+        digest=digest,
+        address=request.remote_addr,
+    )
+    reconcile_cache(device_id, etag, digest)
+    logger.debug("Heartbeat received from %s: %s", device_id, data)
+    return jsonify({"status": "ok", "device_id": device_id, "registered": True, "request_id": g.request_id})
+
+@app.route("/devices", methods=["GET"])
+def list_devices():
+    seen = liveness.snapshot()
+    result = []
+    for device_id, device in devices.items():
+        entry = seen.get(device_id)
+        result.append({
+            "device_id": device_id,
+            "registered": True,
+            # None: no heartbeat yet, requests are still routed to it
+            "online": entry["online"] if entry else None,
+            "circuit": device.breaker.state,
+            "channel": channels.get(device_id) is not None,
+            "last_seen": entry["last_seen"] if entry else None,
+            "expires_in": entry["expires_in"] if entry else None,
+            "version": entry["version"] if entry else None,
+            "etag": entry["etag"] if entry else None,
+            "address": entry["address"] if entry else None,
+        })
+    return jsonify({"devices": result, "request_id": g.request_id})
+
+def fetch_status(device_id: str, client_etag: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    # Conditional read: revalidate what we hold, or pass the client's ETag through when we hold nothing.
+    # Returns (None, etag) only when the bulb confirmed the client's own copy.
+    previous, previous_etag = status_cache.peek(device_id)
+    condition = previous_etag if previous is not None and previous_etag else client_etag
+    r = bulb_get("/status", device_id=device_id, headers={"If-None-Match": condition} if condition else None)
+    if r.status_code == 304:
+        if previous is not None and previous_etag:
+            status_cache.touch(device_id)
+            return previous, previous_etag
+        return None, condition
+    r.raise_for_status()
+    body = r.json()
+    etag = r.headers.get("ETag")
+    status_cache.put(device_id, body, etag)
+    if previous is not None and previous != body:
+        # someone changed the bulb without going through this cloud (Matter, local button...)
+        events.publish(device_id, body, "upstream")
+    return body, etag
+
+def _revalidate_status(device_id: str) -> None:
+    try:
+        fetch_status(device_id)
+    except Exception:
+        logger.warning("Background status refresh failed for %s", device_id, exc_info=True)
+    finally:
+        status_cache.end_refresh(device_id)
+
+def client_has(etag: Optional[str]) -> bool:
+    # If-None-Match is a list of (possibly weak) ETags or "*": whole tokens, weak comparison
+    return bool(etag) and request.if_none_match.contains_weak(unquote_etag(etag)[0])
+
+@app.route("/cloud", methods=["GET"])
+@app.route("/cloud/<device_id>", methods=["GET"])
+def get_status(device_id: Optional[str] = None):
+    device_id = device_id or DEVICE_ID
+    if device_id not in devices:
+        return unknown_device(device_id)
+
+    client_etag = request.headers.get("If-None-Match")
+    body, cache_state, etag = status_cache.get(device_id)
+    status_cache_requests.inc(cache_state)
+    if cache_state == "STALE" and status_cache.begin_refresh(device_id):
+        threading.Thread(target=_revalidate_status, args=(device_id,), daemon=True).start()
+    if body is None:
         try:
-            if enabled is not None:
-                if parse_bool(enabled):
-                    r = bulb_post("/on")
-                else:
-                    r = bulb_post("/off")
-                r.raise_for_status()
-                results["enabled"] = parse_bool(enabled)
-
-            if brightness is not None:
-                r = bulb_post("/brightness", json_body={"level": brightness})
-                r.raise_for_status()
-                results["brightness"] = brightness
-
-            if color is not None:
-                color_up = color.upper()
-                r = bulb_post("/color", json_body={"color": color_up})
-                r.raise_for_status()
-                results["color"] = color_up
-
-            body = {"status": "ok", "applied": results, "request_id": g.request_id}
-            status = 200
-            if idem_key:
-                idempotency_store(idem_key, body, status)
-            return jsonify(body), status
-
-        except requests.HTTPError as e:
-            logger.exception("Upstream returned error")
-            return jsonify({"error": "upstream_http_error", "message": str(e), "request_id": g.request_id}), 502
+            body, etag = fetch_status(device_id, client_etag)
+        except DeviceOffline as e:
+            return jsonify({"error": "device_offline", "message": str(e), "request_id": g.request_id}), 503
+        except CircuitOpen as e:
+            return json_response({"error": "circuit_open", "message": str(e), "retry_after": e.retry_after,
+                                  "request_id": g.request_id}, 503)
         except Exception as e:
-            logger.exception("Failed to apply changes")
+            logger.exception("Failed to fetch status")
             return jsonify({"error": "upstream_error", "message": str(e), "request_id": g.request_id}), 502
 
-    if __name__ == "__main__":
-        host = os.getenv("HOST", "0.0.0.0")
-        port = int(os.getenv("PORT", "6000"))
-        app.run(host=host, port=port)
+    if body is None or client_has(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = jsonify({"request_id": g.request_id, **body})
+    if etag:
+        resp.headers["ETag"] = etag
+    resp.headers["X-Cache"] = cache_state
+    return resp
+
+@app.route("/cloud", methods=["PATCH"])
+@app.route("/cloud/<device_id>", methods=["PATCH"])
+def patch_cloud(device_id: Optional[str] = None):
+    device_id = device_id or DEVICE_ID
+    if device_id not in devices:
+        return unknown_device(device_id)
+
+    with spans.span(g.request_id, "validate"):
+        changes, error = validate_changes(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"error": "validation", "message": error}), 400
+
+    idem_key = request.headers.get("Idempotency-Key")
+    if_match = request.headers.get("If-Match")
+    request_id = g.request_id
+    apply = apply_patch_coalesced if COALESCE_WINDOW_SECONDS > 0 else apply_patch
+    # keys are per request even when writes are merged: a retry replays this request's own answer
+    return run_idempotent(
+        f"{device_id}:{idem_key}" if idem_key else None,
+        lambda: apply(device_id, changes, request_id, if_match),
+    )
+
+@app.route("/cloud/batch", methods=["PATCH"])
+def patch_batch():
+    payload = request.get_json(silent=True) or {}
+    targets = payload.get("devices") or list(devices)
+    if not isinstance(targets, list) or not all(isinstance(d, str) for d in targets):
+        return jsonify({"error": "validation", "message": "'devices' must be a list of device ids"}), 400
+    missing = [d for d in targets if d not in devices]
+    if missing:
+        return jsonify({"error": "unknown_device", "message": f"No device(s): {', '.join(missing)}", "request_id": g.request_id}), 404
+
+    changes, error = validate_changes(payload)
+    if error:
+        return jsonify({"error": "validation", "message": error}), 400
+
+    request_id = g.request_id
+
+    def apply_one(device_id: str) -> Dict[str, Any]:
+        current_request_id.set(request_id)
+        started = time.perf_counter()
+        body, status = apply_patch(device_id, changes, request_id)
+        body.pop("request_id", None)
+        body["http_status"] = status
+        body["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return body
+
+    def run_batch() -> Tuple[Dict[str, Any], int]:
+        started = time.perf_counter()
+        # one slot per device on a bounded pool: total time ~ the slowest bulb
+        results = dict(zip(targets, batch_executor.map(apply_one, targets)))
+        failed = [d for d, r in results.items() if r["http_status"] != 200]
+        body = {
+            "status": "ok" if not failed else "partial",
+            "results": results,
+            "failed": failed,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            "request_id": request_id,
+        }
+        return body, 200 if not failed else 207
+
+    idem_key = request.headers.get("Idempotency-Key")
+    return run_idempotent(f"batch:{idem_key}" if idem_key else None, run_batch)
+
+def format_sse(event: Dict[str, Any]) -> str:
+    return f"id: {event['id']}\nevent: state\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+@app.route("/cloud/events", methods=["GET"])
+def cloud_events():
+    device_filter = request.args.get("device")
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_id = int(last_event_id) if last_event_id else events.last_id
+    except ValueError:
+        return jsonify({"error": "validation", "message": "'Last-Event-ID' must be an integer"}), 400
+
+    def stream():
+        cursor = last_id
+        backlog, gap = events.since(cursor)
+        if gap:
+            # resume point fell out of the buffer: tell the client to re-read GET /cloud
+            current = events.last_id
+            yield f"event: resync\ndata: {json.dumps({'last_event_id': current})}\n\n"
+            # an id from before a cloud restart is ahead of ours: wait() would sit on it forever
+            cursor = min(cursor, current)
+        while True:
+            for event in backlog:
+                cursor = event["id"]
+                if device_filter and event["device_id"] != device_filter:
+                    continue
+                yield format_sse(event)
+            backlog = events.wait(cursor, EVENT_KEEPALIVE_SECONDS)
+            if not backlog:
+                yield ": keepalive\n\n"
+
+    resp = Response(stream(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+class UpgradedResponse(Response):
+    # The socket was handed over to the WebSocket and is closed by now: the server must not
+    # write a response on it. Each server is told so its own way (same as flask-sock).
+    def __init__(self, mode: str):
+        super().__init__()
+        self.mode = mode
+
+    def __call__(self, environ, start_response):
+        if self.mode == "werkzeug":
+            raise ConnectionError("command channel closed")
+        if self.mode == "gunicorn":
+            raise StopIteration()
+        return []
+
+# werkzeug only routes "Upgrade: websocket" requests to rules declared with websocket=True;
+# the plain rule answers everything else with 426
+@app.route("/cloud/channel", methods=["GET"], websocket=True)
+@app.route("/cloud/channel", methods=["GET"])
+def command_channel():
+    # Bulbs dial in here (WebSocket, X-Device-Id header) and then receive commands as frames.
+    if request.headers.get("Upgrade", "").lower() != "websocket" or not request.headers.get("Sec-WebSocket-Key"):
+        return jsonify({"error": "upgrade_required", "message": "WebSocket upgrade expected", "request_id": g.request_id}), 426
+    device_id = request.headers.get("X-Device-Id", "")
+    if device_id not in devices:
+        return unknown_device(device_id)
+    try:
+        ws = simple_websocket.Server.accept(request.environ, ping_interval=CHANNEL_IDLE_SECONDS / 2)
+    except simple_websocket.ConnectionError as e:
+        return jsonify({"error": "bad_request", "message": str(e), "request_id": g.request_id}), 400
+    except RuntimeError:
+        return jsonify({"error": "not_supported", "message": "This server cannot hand over its sockets", "request_id": g.request_id}), 501
+    channel = BulbChannel(device_id, ws)
+    channels.register(channel)
+    try:
+        channel.serve()
+    finally:
+        channels.unregister(channel)
+    return UpgradedResponse(ws.mode)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route("/metrics/spans", methods=["GET"])
+def metrics_spans():
+    # ?request_id= to follow one request (the bulb keeps the matching spans under the same id)
+    try:
+        limit = max(1, min(int(request.args.get("limit", "100")), 1000))
+    except ValueError:
+        return jsonify({"error": "validation", "message": "'limit' must be an integer"}), 400
+    found = spans.query(request.args.get("request_id"), request.args.get("name"), limit)
+    return jsonify({"spans": found, "request_id": g.request_id})
+
+if __name__ == "__main__":
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "6000"))
+    app.run(host=host, port=port)
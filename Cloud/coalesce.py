@@ -0,0 +1,67 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class _Batch:
+    def __init__(self):
+        self.changes: Dict[str, Any] = {}
+        self.requests = 0
+        self.result: Future = Future()
+
+
+class WriteCoalescer:
+    # Per-device pending write. Requests arriving within `window` of the first one are merged
+    # field by field (last writer wins) and flushed to the bulb in a single call; every merged
+    # request then gets the result of that call. Flushes for a device never overlap: a batch
+    # stays open, and keeps absorbing writes, until the previous flush is done.
+    def __init__(self, window: float, flush: Callable[[str, Dict[str, Any], int], Any]):
+        self.window = window
+        self.flush = flush
+        self._open: Dict[str, _Batch] = {}
+        self._flush_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _flush_lock(self, device_id: str) -> threading.Lock:
+        with self._lock:
+            return self._flush_locks.setdefault(device_id, threading.Lock())
+
+    def submit(self, device_id: str, changes: Dict[str, Any]) -> Tuple[Any, int]:
+        # Returns (flush result, number of requests it covered).
+        with self._lock:
+            batch = self._open.get(device_id)
+            leader = batch is None
+            if leader:
+                batch = self._open[device_id] = _Batch()
+            batch.changes.update(changes)
+            batch.requests += 1
+        if leader:
+            time.sleep(self.window)
+            with self._flush_lock(device_id):
+                self._flush_open(device_id, batch)
+        return batch.result.result(), batch.requests
+
+    def run_exclusive(self, device_id: str, fn: Callable[[], Any]) -> Any:
+        # For writes that must not be merged (effects, If-Match): whatever is pending for the
+        # device goes out first, so the bulb still sees the writes in arrival order.
+        with self._flush_lock(device_id):
+            self._flush_open(device_id)
+            return fn()
+
+    def _flush_open(self, device_id: str, batch: Optional[_Batch] = None) -> None:
+        # caller holds the device's flush lock
+        with self._lock:
+            pending = self._open.get(device_id)
+            if pending is None or (batch is not None and pending is not batch):
+                # already flushed by run_exclusive
+                return
+            del self._open[device_id]
+        try:
+            pending.result.set_result(self.flush(device_id, pending.changes, pending.requests))
+        except BaseException as e:
+            pending.result.set_exception(e)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._open)
@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+Entry = Tuple[Dict[str, Any], int]
+
+
+class MemoryIdempotencyStore:
+    # LRU + TTL, private to one process. In-flight keys are tracked with an Event per key.
+    def __init__(self, ttl: float, max_entries: int = 10000, sweep_interval: float = 30.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _sweep_locked(self, now: float) -> None:
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        expired = [k for k, (exp, _, _) in self._entries.items() if exp <= now]
+        for k in expired:
+            del self._entries[k]
+
+    def get(self, key: str) -> Optional[Entry]:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep_locked(now)
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            exp, body, status = entry
+            if exp <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body, status
+
+    def put(self, key: str, body: Dict[str, Any], status: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, body, status)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+    def claim(self, key: str) -> bool:
+        # a stored result counts as a claim too: a duplicate that missed get() must not run again
+        now = time.monotonic()
+        with self._lock:
+            if key in self._inflight:
+                return False
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return False
+            self._inflight[key] = threading.Event()
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+    def wait(self, key: str, timeout: float) -> Optional[Entry]:
+        with self._lock:
+            event = self._inflight.get(key)
+        if event:
+            event.wait(timeout)
+        return self.get(key)
+
+
+class SQLiteIdempotencyStore:
+    # Shared by every worker process on the host through one SQLite file (WAL mode).
+    # A row with pending=1 is a claim by the worker currently talking to the bulb.
+    def __init__(self, path: str, ttl: float, inflight_ttl: float = 30.0,
+                 sweep_interval: float = 30.0, poll_interval: float = 0.05):
+        self.path = path
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self.sweep_interval = sweep_interval
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                " key TEXT PRIMARY KEY,"
+                " expires REAL NOT NULL,"
+                " pending INTEGER NOT NULL,"
+                " status INTEGER,"
+                " body TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        self._conn().execute("DELETE FROM idempotency WHERE expires <= ?", (now,))
+
+    def get(self, key: str) -> Optional[Entry]:
+        now = time.time()
+        self._maybe_sweep(now)
+        row = self._conn().execute(
+            "SELECT status, body FROM idempotency WHERE key = ? AND pending = 0 AND expires > ?",
+            (key, now),
+        ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[1]), row[0]
+
+    def put(self, key: str, body: Dict[str, Any], status: int) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO idempotency (key, expires, pending, status, body) VALUES (?, ?, 0, ?, ?)",
+            (key, time.time() + self.ttl, status, json.dumps(body)),
+        )
+
+    def claim(self, key: str) -> bool:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # an expired row (stale claim from a crashed worker, or an old result) can be taken over
+            conn.execute("DELETE FROM idempotency WHERE key = ? AND expires <= ?", (key, now))
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO idempotency (key, expires, pending) VALUES (?, ?, 1)",
+                (key, now + self.inflight_ttl),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    def release(self, key: str) -> None:
+        self._conn().execute("DELETE FROM idempotency WHERE key = ? AND pending = 1", (key,))
+
+    def wait(self, key: str, timeout: float) -> Optional[Entry]:
+        deadline = time.monotonic() + timeout
+        conn = self._conn()
+        while True:
+            row = conn.execute("SELECT pending, status, body FROM idempotency WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == 0:
+                return json.loads(row[2]), row[1]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+
+def make_store(backend: str, ttl: float, max_entries: int, sweep_interval: float,
+               db_path: str, inflight_ttl: float):
+    backend = backend.lower()
+    if backend == "memory":
+        return MemoryIdempotencyStore(ttl, max_entries=max_entries, sweep_interval=sweep_interval)
+    if backend == "sqlite":
+        return SQLiteIdempotencyStore(db_path, ttl, inflight_ttl=inflight_ttl, sweep_interval=sweep_interval)
+    raise ValueError(f"Unknown idempotency backend '{backend}', expected 'memory' or 'sqlite'")
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    # Hashed timing wheel on the monotonic clock: schedule/cancel are O(1) and advance()
+    # only looks at the slots that went by, so expiry cost does not grow with the fleet.
+    # Deadlines are honoured with up to one tick of delay.
+    def __init__(self, tick: float = 1.0, slots: int = 512, now: Optional[float] = None):
+        self.tick = tick
+        self.slots = slots
+        self._wheel: List[set] = [set() for _ in range(slots)]
+        self._deadlines: Dict[str, Tuple[float, int]] = {}
+        self._cursor = int((time.monotonic() if now is None else now) // tick) - 1
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, key: str, deadline: float) -> None:
+        self.cancel(key)
+        # a deadline in an already processed tick goes in the next one to be processed
+        slot = max(int(deadline // self.tick), self._cursor + 1) % self.slots
+        self._deadlines[key] = (deadline, slot)
+        self._wheel[slot].add(key)
+
+    def cancel(self, key: str) -> None:
+        entry = self._deadlines.pop(key, None)
+        if entry:
+            self._wheel[entry[1]].discard(key)
+
+    def advance(self, now: float) -> List[str]:
+        # Returns the keys whose deadline passed; they are no longer scheduled.
+        current = int(now // self.tick)
+        passed = current - 1 - self._cursor
+        if passed <= 0:
+            return []
+        horizon = current * self.tick
+        expired = []
+        for t in range(self._cursor + 1, self._cursor + 1 + min(passed, self.slots)):
+            bucket = self._wheel[t % self.slots]
+            # keys a full turn (or more) ahead share the slot and stay
+            for key in [k for k in bucket if self._deadlines[k][0] < horizon]:
+                bucket.discard(key)
+                del self._deadlines[key]
+                expired.append(key)
+        self._cursor = current - 1
+        return expired
+
+
+class LivenessTable:
+    # device_id -> last heartbeat. A device is offline once it misses its deadline and
+    # online again on its next heartbeat; devices that never sent one are unknown.
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self._wheel = TimingWheel(tick, slots)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _expire_locked(self, now: float) -> None:
+        for device_id in self._wheel.advance(now):
+            entry = self._entries.get(device_id)
+            if entry and entry["online"]:
+                entry["online"] = False
+                logger.warning("Device %s missed its heartbeats (last seen %.0fs ago), marking offline",
+                               device_id, time.time() - entry["last_seen"])
+
+    def beat(self, device_id: str, ttl: float, **info: Any) -> bool:
+        # Returns True when the device was known to be offline.
+        now = time.monotonic()
+        with self._lock:
+            self._expire_locked(now)
+            previous = self._entries.get(device_id)
+            self._entries[device_id] = {**info, "online": True, "last_seen": time.time(), "deadline": now + ttl}
+            self._wheel.schedule(device_id, now + ttl)
+        if previous is not None and not previous["online"]:
+            logger.info("Device %s is back online", device_id)
+            return True
+        return False
+
+    def is_offline(self, device_id: str) -> bool:
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            entry = self._entries.get(device_id)
+            return entry is not None and not entry["online"]
+
+    def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            entry = self._entries.get(device_id)
+            return dict(entry) if entry else None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire_locked(now)
+            return {
+                device_id: {**{k: v for k, v in entry.items() if k != "deadline"},
+                            "expires_in": round(max(0.0, entry["deadline"] - now), 1)}
+                for device_id, entry in self._entries.items()
+            }
+
+    def online_count(self) -> int:
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            return sum(1 for entry in self._entries.values() if entry["online"])
@@ -0,0 +1,173 @@
+import bisect
+import contextlib
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Minimal Prometheus text-format metrics (no client library dependency).
+# The bulb image is built from Bulb/ alone, so Bulb/metrics.py carries a copy of this file.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _label_key(item) -> Tuple[str, ...]:
+    # label values may mix types (e.g. status 200 and "error"); order them as text
+    return tuple(str(v) for v in item[0])
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: Any) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items(), key=_label_key)
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: Any) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted(((labels, list(row)) for labels, row in self._values.items()), key=_label_key)
+        for labels, row in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(row[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Gauge:
+    # Read at scrape time: fn() returns a number, or {label values tuple: number}.
+    def __init__(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        value = self.fn()
+        items = sorted(value.items(), key=_label_key) if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, fn, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class SpanRecorder:
+    # Fixed-size ring of timing spans, keyed by X-Request-Id so one request can be
+    # followed across services. Recording is one deque append.
+    def __init__(self, size: int = 2048):
+        self._spans: deque = deque(maxlen=size)
+
+    def record(self, request_id: Optional[str], name: str, started: float, duration: float, **attrs: Any) -> None:
+        self._spans.append((request_id, name, started, duration, attrs))
+
+    @contextlib.contextmanager
+    def span(self, request_id: Optional[str], name: str, **attrs: Any):
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record(request_id, name, started, time.perf_counter() - t0, **attrs)
+
+    def query(self, request_id: Optional[str] = None, name: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for rid, span_name, started, duration, attrs in reversed(list(self._spans)):
+            if request_id and rid != request_id:
+                continue
+            if name and span_name != name:
+                continue
+            out.append({"request_id": rid, "name": span_name, "start": round(started, 6),
+                        "duration_ms": round(duration * 1000, 3), **attrs})
+            if len(out) >= limit:
+                break
+        out.reverse()
+        return out
+
+    def __len__(self) -> int:
+        return len(self._spans)
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for part in ("Cloud", "Bulb", "monitor"):
+    sys.path.insert(0, os.path.join(ROOT, part))
+
+# pin import-time configuration of both apps: one bulb, no key, nothing written outside tmp
+os.environ["DEVICES"] = "default=http://bulb.test"
+os.environ.pop("DEVICES_FILE", None)
+os.environ.pop("API_KEY", None)
+os.environ.pop("JOURNAL_PATH", None)
+
+
+class FakeBulb(BaseAdapter):
+    # Answers the bulb routes the cloud calls and counts them; `delay` holds every call that long,
+    # and the next `failures` calls answer 500.
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.delay = delay
+        self.failures = 0
+        self.calls = []
+        self.state = {"is_on": False, "enabled": False, "brightness": 100, "color": "#FFFFFF", "version": 0}
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        path = request.path_url.split("?")[0]
+        with self._lock:
+            self.calls.append((request.method, path))
+        if self.delay:
+            threading.Event().wait(self.delay)
+        with self._lock:
+            failing = self.failures > 0
+            self.failures -= failing
+        if failing:
+            resp = requests.Response()
+            resp.status_code = 500
+            resp.request = request
+            resp.url = request.url
+            resp._content = b"boom"
+            return resp
+        if request.method == "POST" and path == "/state":
+            body = json.loads(request.body)
+            with self._lock:
+                if "enabled" in body:
+                    self.state["is_on"] = self.state["enabled"] = body["enabled"]
+                for field in ("brightness", "color"):
+                    if field in body:
+                        self.state[field] = body[field]
+                self.state["version"] += 1
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.request = request
+        resp.url = request.url
+        resp.headers = CaseInsensitiveDict({"Content-Type": "application/json",
+                                            "ETag": f'"test-{self.state["version"]}"'})
+        resp._content = json.dumps(self.state).encode()
+        return resp
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def cloud():
+    import cloud_server
+    device = cloud_server.devices["default"]
+    fake = FakeBulb()
+    device.session.mount("http://bulb.test", fake)
+    cloud_server.status_cache.invalidate("default")
+    yield cloud_server, fake
+    device.session.adapters.pop("http://bulb.test")
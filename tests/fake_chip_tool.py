@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# Stand-in for `chip-tool interactive start`: one command per stdin line, the output
+# of a real build around it. First word: "bad" fails, "hang" never answers, "crash" exits.
+import os
+import sys
+import time
+
+if sys.argv[1:] != ["interactive", "start"]:
+    sys.exit(0)
+delay = float(os.getenv("FAKE_CHIP_TOOL_DELAY", "0.02"))
+for line in sys.stdin:
+    args = line.split()
+    if not args:
+        continue
+    time.sleep(delay)
+    if args[0] == "crash":
+        os._exit(3)
+    if args[0] == "hang":
+        time.sleep(3600)
+    print(f"[1] CHIP:TOO: Command: {line.strip()}", flush=True)
+    # what a retransmission looks like: an error line in the middle of a command that may still succeed
+    print("[1] CHIP:EM: Retransmit: CHIP Error 0x00000032: Timeout", flush=True)
+    if args[0] == "bad":
+        print("[1] CHIP:TOO: Received Command Response Status for Endpoint=1 Cluster=0x0000_0006 "
+              "Command=0x0000_0001 Status=0x81", flush=True)
+        print("[1] CHIP:TOO: Run command failure: IM Error 0x00000581: General error: 0x81", flush=True)
+    else:
+        print("[1] CHIP:TOO: Received Command Response Status for Endpoint=1 Cluster=0x0000_0006 "
+              "Command=0x0000_0001 Status=0x0", flush=True)
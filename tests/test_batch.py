@@ -0,0 +1,51 @@
+import pytest
+
+from conftest import FakeBulb
+
+
+@pytest.fixture
+def fleet(cloud):
+    # "default" plus two more bulbs, each behind its own slow fake
+    cloud_server, default = cloud
+    default.delay = 0.1
+    bulbs = {"default": default}
+    for device_id in ("a", "b"):
+        device = cloud_server.Device(device_id, f"http://{device_id}.test")
+        bulbs[device_id] = FakeBulb(delay=0.1)
+        device.session.mount(f"http://{device_id}.test", bulbs[device_id])
+        cloud_server.devices[device_id] = device
+    yield cloud_server, bulbs
+    for device_id in ("a", "b"):
+        del cloud_server.devices[device_id]
+
+
+def test_batch_reaches_every_bulb_at_once(fleet):
+    cloud_server, bulbs = fleet
+    resp = cloud_server.app.test_client().patch("/cloud/batch", json={"brightness": 30})
+    body = resp.get_json()
+    assert resp.status_code == 200
+    assert body["status"] == "ok" and body["failed"] == []
+    assert sorted(body["results"]) == ["a", "b", "default"]
+    assert all(r["http_status"] == 200 for r in body["results"].values())
+    assert all(b.state["brightness"] == 30 for b in bulbs.values())
+    # concurrent: about one bulb's delay, not three
+    assert body["elapsed_ms"] < 250
+
+
+def test_batch_with_a_failing_bulb_is_multi_status(fleet):
+    cloud_server, bulbs = fleet
+    bulbs["b"].failures = 1
+    resp = cloud_server.app.test_client().patch("/cloud/batch", json={"devices": ["a", "b"], "color": "#00FF00"})
+    body = resp.get_json()
+    assert resp.status_code == 207
+    assert body["status"] == "partial" and body["failed"] == ["b"]
+    assert body["results"]["a"]["http_status"] == 200
+    assert body["results"]["b"]["http_status"] == 502
+    assert bulbs["default"].calls == []
+
+
+def test_batch_with_an_unknown_device_runs_nothing(fleet):
+    cloud_server, bulbs = fleet
+    resp = cloud_server.app.test_client().patch("/cloud/batch", json={"devices": ["a", "nope"], "brightness": 30})
+    assert resp.status_code == 404
+    assert all(b.calls == [] for b in bulbs.values())
@@ -0,0 +1,106 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+import breaker as breaker_module
+from breaker import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(breaker_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_cycle(clock):
+    breaker = CircuitBreaker("bulb", min_requests=4, error_rate=0.5, open_seconds=10, half_open_probes=1)
+    for ok in (True, True, False):
+        assert breaker.allow()
+        breaker.record(ok, 0.01)
+    assert breaker.state == "closed"
+    breaker.record(False, 0.01)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.retry_after() == 10
+
+    clock[0] += 10
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # one probe at a time
+    assert not breaker.allow()
+    breaker.record(False, 0.01)
+    assert breaker.state == "open"
+
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_slow_calls_open_the_circuit(clock):
+    breaker = CircuitBreaker("bulb", min_requests=3, slow_call=1.0, slow_rate=0.6)
+    for latency in (1.5, 0.1, 1.5):
+        breaker.record(True, latency)
+    assert breaker.state == "open"
+
+
+def test_outcomes_leave_the_window(clock):
+    breaker = CircuitBreaker("bulb", window=5, min_requests=2, error_rate=0.5)
+    breaker.record(False, 0.01)
+    clock[0] += 6
+    breaker.record(True, 0.01)
+    breaker.record(True, 0.01)
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_is_given_back(clock):
+    breaker = CircuitBreaker("bulb", min_requests=1, open_seconds=10)
+    breaker.record(False, 0.01)
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_failing_bulb_is_cut_off(cloud, monkeypatch):
+    cloud_server, bulb = cloud
+    device = cloud_server.devices["default"]
+    monkeypatch.setattr(device, "breaker", CircuitBreaker("default", min_requests=3, open_seconds=30))
+    bulb.failures = 3
+    client = cloud_server.app.test_client()
+    assert [client.patch("/cloud", json={"brightness": 40}).status_code for _ in range(3)] == [502] * 3
+    resp = client.patch("/cloud", json={"brightness": 40})
+    assert resp.status_code == 503
+    assert resp.get_json()["error"] == "circuit_open"
+    assert resp.headers["Retry-After"] == "30"
+    assert len(bulb.calls) == 3
+
+
+def test_hedge_answers_when_the_first_attempt_stalls(cloud):
+    cloud_server, _ = cloud
+    release = threading.Event()
+    counter = itertools.count()
+
+    def call():
+        if next(counter) == 0:
+            release.wait(5)
+            return "primary"
+        return "hedge"
+
+    started = time.monotonic()
+    assert cloud_server.hedged(call, "default", 0.05) == "hedge"
+    assert time.monotonic() - started < 1
+    release.set()
+
+
+def test_no_hedge_when_the_first_attempt_is_quick(cloud):
+    cloud_server, _ = cloud
+    counter = itertools.count()
+    assert cloud_server.hedged(lambda: next(counter), "default", 0.5) == 0
+    assert next(counter) == 1
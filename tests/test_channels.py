@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.fixture
+def away(cloud):
+    # a bulb reachable only over its command channel, which it has not opened
+    cloud_server, _ = cloud
+    cloud_server.devices["away"] = cloud_server.Device("away", "channel")
+    yield cloud_server, cloud_server.devices["away"]
+    del cloud_server.devices["away"]
+
+
+def test_channel_only_bulb_without_channel_is_offline(away):
+    cloud_server, device = away
+    client = cloud_server.app.test_client()
+    for _ in range(device.breaker.min_requests * 2):
+        resp = client.patch("/cloud/away", json={"brightness": 40})
+        assert resp.status_code == 503
+        assert resp.get_json()["error"] == "device_offline"
+    assert device.breaker.state == "closed"
+
+
+def test_dropped_channel_gives_back_half_open_probe(away):
+    cloud_server, device = away
+    breaker = device.breaker
+    breaker.state = "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_plain_get_on_channel_asks_for_upgrade(cloud):
+    cloud_server, _ = cloud
+    resp = cloud_server.app.test_client().get("/cloud/channel", headers={"X-Device-Id": "default"})
+    assert resp.status_code == 426
+    assert resp.get_json()["error"] == "upgrade_required"
+
+
+@pytest.mark.parametrize("device_id", ["batch", "channel", "events"])
+def test_route_names_are_not_device_ids(cloud, monkeypatch, device_id):
+    cloud_server, _ = cloud
+    monkeypatch.setattr(cloud_server, "DEVICES", f"{device_id}=http://bulb.test")
+    with pytest.raises(ValueError, match="reserved"):
+        cloud_server.load_device_hosts()
@@ -0,0 +1,51 @@
+import os
+import time
+
+import pytest
+
+from chiptool import ChipToolCommandFailed, ChipToolError, ChipToolSession
+
+FAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_chip_tool.py")
+
+
+@pytest.fixture
+def session():
+    session = ChipToolSession(FAKE, timeout=5)
+    yield session
+    session.close()
+
+
+def test_pipelined_commands_complete_in_order_on_one_process(session):
+    futures = [session.submit(["onoff", "toggle", str(i), "1"]) for i in range(5)]
+    outputs = [f.result(5) for f in futures]
+    for i, output in enumerate(outputs):
+        assert f"Command: onoff toggle {i} 1" in output
+    assert session.starts == 1
+
+
+def test_failure_fails_only_its_own_command(session):
+    futures = [session.submit([name, "1"]) for name in ("first", "bad", "third")]
+    assert "Command: first 1" in futures[0].result(5)
+    with pytest.raises(ChipToolCommandFailed, match="Run command failure"):
+        futures[1].result(5)
+    assert "Command: third 1" in futures[2].result(5)
+    assert session.starts == 1
+
+
+def test_timeout_restarts_the_session(session):
+    started = time.monotonic()
+    with pytest.raises(ChipToolError, match="timed out"):
+        session.run(["hang"], timeout=0.3)
+    assert time.monotonic() - started < 2
+    assert "Command: after 1" in session.run(["after", "1"])
+    assert session.starts == 2
+
+
+def test_crash_fails_pending_commands_and_next_one_restarts(session):
+    crashed = session.submit(["crash"])
+    queued = session.submit(["queued", "1"])
+    for fut in (crashed, queued):
+        with pytest.raises(ChipToolError, match="exited"):
+            fut.result(5)
+    assert "Command: again 1" in session.run(["again", "1"])
+    assert session.starts == 2
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from coalesce import WriteCoalescer
+
+
+class Recorder:
+    # the flush callback: logs what reaches "the bulb", optionally slowly, and checks nothing overlaps
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.log = []
+        self.active = 0
+        self.overlapped = False
+        self._lock = threading.Lock()
+
+    def __call__(self, device_id, changes, merged):
+        with self._lock:
+            self.active += 1
+            self.overlapped |= self.active > 1
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+            self.log.append(("flush", device_id, dict(changes), merged))
+        if self.error:
+            raise self.error
+        return {"applied": dict(changes)}
+
+
+def submit_later(coalescer, results, name, delay, changes):
+    def run():
+        time.sleep(delay)
+        try:
+            results[name] = coalescer.submit("default", changes)
+        except Exception as e:
+            results[name] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_writes_within_the_window_merge_last_writer_wins():
+    flush = Recorder()
+    coalescer = WriteCoalescer(0.2, flush)
+    results = {}
+    threads = [
+        submit_later(coalescer, results, "first", 0.0, {"brightness": 10, "color": "#111111"}),
+        submit_later(coalescer, results, "second", 0.05, {"brightness": 20}),
+        submit_later(coalescer, results, "third", 0.1, {"enabled": True}),
+    ]
+    for t in threads:
+        t.join(5)
+    merged = {"brightness": 20, "color": "#111111", "enabled": True}
+    assert flush.log == [("flush", "default", merged, 3)]
+    assert all(r == ({"applied": merged}, 3) for r in results.values())
+    assert len(coalescer) == 0
+
+
+def test_exclusive_write_flushes_what_is_pending_first():
+    flush = Recorder()
+    coalescer = WriteCoalescer(0.2, flush)
+    results = {}
+    thread = submit_later(coalescer, results, "merged", 0.0, {"brightness": 10})
+    time.sleep(0.05)
+    out = coalescer.run_exclusive("default", lambda: flush.log.append(("exclusive",)) or "effect")
+    thread.join(5)
+    assert out == "effect"
+    assert flush.log == [("flush", "default", {"brightness": 10}, 1), ("exclusive",)]
+    # the batch's leader wakes up after its window and finds its result already there
+    assert results["merged"] == ({"applied": {"brightness": 10}}, 1)
+
+
+def test_flushes_for_a_device_never_overlap():
+    flush = Recorder(delay=0.15)
+    coalescer = WriteCoalescer(0.02, flush)
+    results = {}
+    threads = [
+        submit_later(coalescer, results, "first", 0.0, {"brightness": 10}),
+        # arrives while the first flush is with the bulb: waits for it, in a batch of its own
+        submit_later(coalescer, results, "second", 0.08, {"brightness": 20}),
+        submit_later(coalescer, results, "third", 0.1, {"color": "#222222"}),
+    ]
+    for t in threads:
+        t.join(5)
+    assert not flush.overlapped
+    assert [entry[2] for entry in flush.log] == [{"brightness": 10}, {"brightness": 20, "color": "#222222"}]
+    assert results["second"] == results["third"]
+
+
+def test_flush_error_reaches_every_merged_request():
+    coalescer = WriteCoalescer(0.1, Recorder(error=RuntimeError("bulb down")))
+    results = {}
+    threads = [submit_later(coalescer, results, name, delay, {"brightness": 10})
+               for name, delay in (("first", 0.0), ("second", 0.03))]
+    for t in threads:
+        t.join(5)
+    assert all(isinstance(r, RuntimeError) for r in results.values())
+
+
+@pytest.fixture
+def coalescing(cloud, monkeypatch):
+    cloud_server, bulb = cloud
+    monkeypatch.setattr(cloud_server, "COALESCE_WINDOW_SECONDS", 0.1)
+    monkeypatch.setattr(cloud_server.coalescer, "window", 0.1)
+    return cloud_server, bulb
+
+
+def test_burst_of_patches_is_one_bulb_write(coalescing):
+    cloud_server, bulb = coalescing
+    responses = []
+
+    def send(body):
+        responses.append(cloud_server.app.test_client().patch("/cloud", json=body))
+
+    threads = [threading.Thread(target=send, args=(body,)) for body in
+               ({"brightness": 10}, {"brightness": 30}, {"color": "#00FF00"})]
+    for t in threads:
+        t.start()
+        time.sleep(0.01)
+    for t in threads:
+        t.join(5)
+    assert bulb.calls == [("POST", "/state")]
+    assert [r.status_code for r in responses] == [200] * 3
+    assert {r.get_json()["coalesced"] for r in responses} == {3}
+    assert bulb.state["brightness"] == 30 and bulb.state["color"] == "#00FF00"
+
+
+def test_effect_goes_out_after_the_pending_write(coalescing):
+    cloud_server, bulb = coalescing
+    responses = {}
+
+    def send(name, body):
+        responses[name] = cloud_server.app.test_client().patch("/cloud", json=body)
+
+    pending = threading.Thread(target=send, args=("brightness", {"brightness": 10}))
+    pending.start()
+    time.sleep(0.03)
+    send("effect", {"effect": {"keyframes": [{"color": "#FF0000", "duration": 1}]}})
+    pending.join(5)
+    assert bulb.calls == [("POST", "/state"), ("POST", "/effect")]
+    assert responses["brightness"].status_code == responses["effect"].status_code == 200
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import discovery
+import network
+import scenario
+from discovery import DiscoveryCache, parse_announcement, probe
+
+
+@pytest.fixture
+def responder():
+    # the bulb's probe responder on a loopback port of its own
+    loop = asyncio.new_event_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.setblocking(False)
+    ready = threading.Event()
+
+    async def serve():
+        await loop.create_datagram_endpoint(network.DiscoveryResponder, sock=sock)
+        ready.set()
+
+    thread = threading.Thread(target=lambda: (loop.run_until_complete(serve()), loop.run_forever()), daemon=True)
+    thread.start()
+    assert ready.wait(5)
+    yield sock.getsockname()[1]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    sock.close()
+    loop.close()
+
+
+def test_probe_finds_the_bulb(responder):
+    cache = DiscoveryCache(ttl=60)
+    found = probe(cache, "default", timeout=2, port=responder, address="127.0.0.1")
+    assert [info["device_id"] for info in found] == ["default"]
+    assert found[0]["base_url"] == f"http://127.0.0.1:{network.CONTROL_PORT}"
+    assert found[0]["etag"] == network.bulb.etag()
+    assert cache.get("default") == found[0]
+
+
+def test_probe_for_another_bulb_gets_no_answer(responder):
+    cache = DiscoveryCache(ttl=60)
+    assert probe(cache, "kitchen", timeout=0.2, port=responder, address="127.0.0.1") == []
+    assert cache.devices() == []
+
+
+@pytest.mark.parametrize("data", [
+    b"not json",
+    json.dumps({"type": "SMARTBULB_DISCOVERY", "device_id": "default", "port": "5000"}).encode(),
+    json.dumps({"type": "SMARTBULB_DISCOVERY", "device_id": "default", "port": True}).encode(),
+    discovery.probe_message("default"),
+])
+def test_only_well_formed_announcements_are_kept(data):
+    assert parse_announcement(data, ("10.0.0.5", 37020)) is None
+
+
+def test_cache_forgets_silent_bulbs(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(discovery.time, "monotonic", lambda: now[0])
+    cache = DiscoveryCache(ttl=60)
+    cache.put(parse_announcement(discovery.announcement("default", 5000, 1), ("10.0.0.5", 37020)))
+    now[0] += 59
+    assert cache.get("default")["base_url"] == "http://10.0.0.5:5000"
+    now[0] += 1
+    assert cache.get("default") is None
+
+
+class LanBulb(BaseAdapter):
+    # the bulb as reached over the LAN; `down` makes every call fail like an unplugged bulb
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.calls = []
+
+    def send(self, request, **kwargs):
+        self.calls.append((request.method, request.path_url))
+        if self.down:
+            raise requests.ConnectionError("no route to host")
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.request = request
+        resp.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        resp._content = json.dumps(dict(json.loads(request.body), version=1)).encode()
+        return resp
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def lan(monkeypatch):
+    cache = DiscoveryCache(ttl=60)
+    cache.put(parse_announcement(discovery.announcement("default", 5000, 1), ("lan.test", 37020)))
+    monkeypatch.setattr(scenario, "_discovery", cache)
+    # no real listener, and no probe while the cache is empty
+    monkeypatch.setattr(scenario, "_discovery_listener", object())
+    monkeypatch.setattr(scenario, "_next_probe", float("inf"))
+    monkeypatch.setattr(scenario, "LOCAL_DEVICE_ID", "default")
+    bulb = LanBulb()
+    scenario.local_session.mount("http://lan.test:5000", bulb)
+    yield bulb, cache
+    scenario.local_session.adapters.pop("http://lan.test:5000")
+
+
+def test_local_write_goes_straight_to_the_bulb(lan):
+    bulb, cache = lan
+    assert scenario.local_apply(brightness=40) is True
+    assert bulb.calls == [("POST", "/state")]
+
+
+def test_unreachable_bulb_falls_back_and_is_forgotten(lan):
+    bulb, cache = lan
+    bulb.down = True
+    assert scenario.local_apply(brightness=40) is False
+    assert cache.get("default") is None
+    # the next write goes to the cloud without trying the LAN again
+    assert scenario.local_apply(brightness=40) is False
+    assert len(bulb.calls) == 1
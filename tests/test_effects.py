@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+import bulb
+
+PARTY = {"mode": "step", "loop": 0, "keyframes": [
+    {"color": "#FF0000", "duration": 0.02},
+    {"color": "#00FF00", "duration": 0.02},
+]}
+
+
+@pytest.fixture
+def playing():
+    client = bulb.app.test_client()
+    assert client.post("/effect", json=PARTY).status_code == 200
+    yield client
+    bulb.effects.stop()
+
+
+@pytest.mark.parametrize("path, body, headers, status", [
+    ("/state", {"brightness": "dim"}, {}, 400),
+    ("/state", {"brightness": 10}, {"If-Match": '"stale-0"'}, 412),
+    ("/color", {"color": "red"}, {}, 400),
+])
+def test_rejected_write_leaves_effect_running(playing, path, body, headers, status):
+    assert playing.post(path, json=body, headers=headers).status_code == status
+    assert bulb.effects.running()
+    version = bulb.bulb.version
+    time.sleep(0.1)
+    assert bulb.bulb.version > version
+
+
+def test_accepted_write_wins_over_effect(playing):
+    time.sleep(0.05)
+    resp = playing.post("/state", json={"brightness": 10, "color": "#0000FF"})
+    assert resp.status_code == 200
+    time.sleep(0.1)
+    assert not bulb.effects.running()
+    assert bulb.bulb.status() == resp.get_json()
@@ -0,0 +1,53 @@
+import pytest
+
+import bulb
+
+
+@pytest.fixture
+def bulb_etag():
+    return bulb.bulb.etag()
+
+
+@pytest.mark.parametrize("header, matches", [
+    ("{etag}", True),
+    ('"other", {etag}', True),
+    ("W/{etag}", True),
+    ("*", True),
+    ('"{value}0"', False),
+    ('"x{value}"', False),
+    ('"other"', False),
+])
+def test_bulb_if_none_match(bulb_etag, header, matches):
+    value = bulb_etag.strip('"')
+    resp = bulb.app.test_client().get("/status", headers={"If-None-Match": header.format(etag=bulb_etag, value=value)})
+    assert resp.status_code == (304 if matches else 200)
+
+
+@pytest.mark.parametrize("header, applies", [
+    ("{etag}", True),
+    ('"a-1", {etag}, "a-2"', True),
+    ("*", True),
+    ("W/{etag}", False),
+    ('"a-1", "a-2"', False),
+    ('"{value}0"', False),
+])
+def test_bulb_if_match(bulb_etag, header, applies):
+    value = bulb_etag.strip('"')
+    resp = bulb.app.test_client().post("/state", json={"brightness": 50},
+                                       headers={"If-Match": header.format(etag=bulb_etag, value=value)})
+    assert resp.status_code == (200 if applies else 412)
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"test-0"', True),
+    ('W/"test-0", "x"', True),
+    ("*", True),
+    ('"test-00"', False),
+    ('"test-"', False),
+])
+def test_cloud_if_none_match(cloud, header, matches):
+    cloud_server, _ = cloud
+    client = cloud_server.app.test_client()
+    assert client.get("/cloud").headers["ETag"] == '"test-0"'
+    resp = client.get("/cloud", headers={"If-None-Match": header})
+    assert resp.status_code == (304 if matches else 200)
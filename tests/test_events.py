@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def bus(cloud, monkeypatch):
+    cloud_server, _ = cloud
+    bus = cloud_server.EventBus(3)
+    monkeypatch.setattr(cloud_server, "events", bus)
+    monkeypatch.setattr(cloud_server, "EVENT_KEEPALIVE_SECONDS", 0.05)
+    return cloud_server, bus
+
+
+def open_stream(cloud_server, last_event_id):
+    resp = cloud_server.app.test_client().get(
+        "/cloud/events", headers={"Last-Event-ID": str(last_event_id)}, buffered=False)
+    return resp, iter(resp.response)
+
+
+def chunk(it):
+    # next SSE message, keepalives skipped (a stream stuck on keepalives fails instead of hanging)
+    for _ in range(20):
+        text = next(it)
+        text = text.decode() if isinstance(text, bytes) else text
+        if not text.startswith(":"):
+            return text
+    raise AssertionError("only keepalives")
+
+
+def event_id(text):
+    return json.loads(text.split("data: ", 1)[1])["id"]
+
+
+def test_resume_replays_missed_events(bus):
+    cloud_server, events = bus
+    for brightness in (10, 20):
+        events.publish("default", {"brightness": brightness}, "patch")
+    resp, it = open_stream(cloud_server, 1)
+    assert event_id(chunk(it)) == 2
+    events.publish("default", {"brightness": 30}, "patch")
+    assert event_id(chunk(it)) == 3
+    resp.close()
+
+
+def test_resume_point_dropped_from_buffer_asks_for_resync(bus):
+    cloud_server, events = bus
+    for brightness in range(5):
+        events.publish("default", {"brightness": brightness}, "patch")
+    resp, it = open_stream(cloud_server, 1)
+    assert chunk(it).startswith("event: resync")
+    # what the buffer still holds follows
+    assert [event_id(chunk(it)) for _ in range(3)] == [3, 4, 5]
+    resp.close()
+
+
+def test_resume_point_from_before_a_restart_asks_for_resync(bus):
+    cloud_server, events = bus
+    events.publish("default", {"brightness": 10}, "patch")
+    resp, it = open_stream(cloud_server, 500)
+    first = chunk(it)
+    assert first.startswith("event: resync")
+    assert json.loads(first.split("data: ", 1)[1]) == {"last_event_id": 1}
+    assert cloud_server.app.test_client().patch("/cloud", json={"brightness": 40}).status_code == 200
+    assert event_id(chunk(it)) == 2
+    resp.close()
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from idempotency import MemoryIdempotencyStore
+
+
+def test_claim_refused_while_result_is_stored():
+    store = MemoryIdempotencyStore(ttl=60)
+    assert store.claim("k")
+    store.put("k", {"status": "ok"}, 200)
+    assert not store.claim("k")
+    assert store.wait("k", 0.1) == ({"status": "ok"}, 200)
+
+
+def test_claim_allowed_once_result_expired():
+    store = MemoryIdempotencyStore(ttl=0.01)
+    assert store.claim("k")
+    store.put("k", {"status": "ok"}, 200)
+    time.sleep(0.02)
+    assert store.claim("k")
+
+
+def test_duplicate_reaches_bulb_once(cloud, monkeypatch):
+    cloud_server, bulb = cloud
+    bulb.delay = 0.1
+    original_done = threading.Event()
+    lookup = cloud_server.idempotency_lookup
+
+    def late_lookup(key):
+        # the duplicate looked before the original stored its result, and only gets to claim after
+        if threading.current_thread().name == "duplicate":
+            original_done.wait(5)
+            return None
+        return lookup(key)
+
+    monkeypatch.setattr(cloud_server, "idempotency_lookup", late_lookup)
+    key = f"dup-{time.monotonic_ns()}"
+    responses = {}
+
+    def send(name):
+        client = cloud_server.app.test_client()
+        responses[name] = client.patch("/cloud", json={"brightness": 40}, headers={"Idempotency-Key": key})
+        if name == "original":
+            original_done.set()
+
+    threads = [threading.Thread(target=send, args=(name,), name=name) for name in ("original", "duplicate")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert bulb.calls == [("POST", "/state")]
+    assert responses["original"].status_code == responses["duplicate"].status_code == 200
+    assert responses["duplicate"].get_json()["idempotent"] is True
+
+
+def test_duplicate_runs_the_write_when_the_original_fails(cloud):
+    cloud_server, bulb = cloud
+    bulb.delay = 0.1
+    bulb.failures = 1
+    key = f"retry-{time.monotonic_ns()}"
+    responses = {}
+
+    def send(name):
+        client = cloud_server.app.test_client()
+        responses[name] = client.patch("/cloud", json={"brightness": 40}, headers={"Idempotency-Key": key})
+
+    original = threading.Thread(target=send, args=("original",))
+    original.start()
+    # the duplicate arrives while the original is with the bulb, and waits on it
+    time.sleep(0.03)
+    send("duplicate")
+    original.join(10)
+
+    assert responses["original"].status_code == 502
+    assert responses["duplicate"].status_code == 200
+    assert "idempotent" not in responses["duplicate"].get_json()
+    assert bulb.calls == [("POST", "/state"), ("POST", "/state")]
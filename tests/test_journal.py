@@ -0,0 +1,44 @@
+import time
+
+import bulb as bulb_module
+from bulb import EffectPlayer, SmartBulb, parse_effect
+from journal import Journal
+
+
+def test_import_opens_no_journal():
+    assert bulb_module.journal is None
+    assert bulb_module.bulb.journal is None
+
+
+def test_effect_journals_start_and_end_only(tmp_path):
+    journal = Journal(str(tmp_path / "journal.bin"), capacity=64)
+    bulb = SmartBulb()
+    bulb.restore(journal)
+    player = EffectPlayer(bulb, tick=0.01)
+    player.start(parse_effect({"mode": "fade", "loop": 1, "keyframes": [
+        {"color": "#FF0000", "brightness": 10, "duration": 0.2},
+        {"color": "#0000FF", "brightness": 90, "duration": 0.2},
+    ]}))
+    player._thread.join(5)
+
+    assert bulb.version > 10
+    records, _ = journal.range()
+    assert [r["source"] for r in records] == ["effect", "effect"]
+    assert records[0]["state"]["is_on"] is True
+    assert records[-1]["state"] == {"is_on": True, "brightness": 90, "color": "#0000FF"}
+    assert records[-1]["version"] == bulb.version
+
+
+def test_restore_after_effect(tmp_path):
+    path = str(tmp_path / "journal.bin")
+    bulb = SmartBulb()
+    bulb.restore(Journal(path, capacity=64))
+    bulb.apply_state(enabled=True, brightness=30)
+    player = EffectPlayer(bulb, tick=0.01)
+    player.start(parse_effect({"mode": "fade", "loop": 0, "keyframes": [{"color": "#00FF00", "duration": 0.05}]}))
+    time.sleep(0.1)
+    player.stop()
+
+    restored = SmartBulb()
+    restored.restore(Journal(path, capacity=64))
+    assert restored.status() == bulb.status()
@@ -0,0 +1,16 @@
+def test_heartbeat_from_unknown_device_is_not_tracked(cloud):
+    cloud_server, _ = cloud
+    client = cloud_server.app.test_client()
+    before = len(cloud_server.liveness.snapshot())
+    for i in range(50):
+        resp = client.post("/heartbeat", json={"device_id": f"stranger-{i}", "interval": 60})
+        assert resp.status_code == 404
+        assert resp.get_json()["error"] == "unknown_device"
+    assert len(cloud_server.liveness.snapshot()) == before
+
+
+def test_heartbeat_from_registered_device(cloud):
+    cloud_server, _ = cloud
+    resp = cloud_server.app.test_client().post("/heartbeat", json={"device_id": "default", "interval": 60})
+    assert resp.status_code == 200
+    assert cloud_server.liveness.get("default")["online"] is True
@@ -0,0 +1,74 @@
+import json
+import threading
+
+import pytest
+
+import loadgen
+import scenario
+from simulate import StandIn
+
+URL = "http://cloud.loadgen"
+
+
+class CountedPacer:
+    # lets exactly `n` operations start, whatever the time
+    def __init__(self, n):
+        self.n = n
+
+    def wait(self, deadline):
+        self.n -= 1
+        return self.n >= 0
+
+
+class Recording(StandIn):
+    def send(self, request, **kwargs):
+        self.bodies.append((request.method, request.path_url, json.loads(request.body) if request.body else None))
+        return super().send(request, **kwargs)
+
+
+@pytest.fixture
+def cloud(monkeypatch):
+    # a fresh stand-in cloud (bulb off, version 0) on every call
+    monkeypatch.setattr(scenario, "BASE_URL", URL)
+    monkeypatch.setattr(scenario, "THINK_TIME_SCALE", 0.0)
+
+    def fresh():
+        stand_in = Recording(scenario.VirtualClock())
+        stand_in.bodies = []
+        scenario.session.mount(URL, stand_in)
+        return stand_in
+
+    yield fresh
+    scenario.session.adapters.pop(URL, None)
+
+
+def run_controller(seed, ops=30):
+    mirrors = []
+
+    def target():
+        loadgen.controller(CountedPacer(ops), float("inf"), loadgen.parse_mix(loadgen.DEFAULT_MIX),
+                           loadgen.Recorder(), seed)
+        mirrors.append(scenario.household_mirror.get())
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join(30)
+    return mirrors[0]
+
+
+def test_same_seed_same_traffic(cloud):
+    first = cloud()
+    run_controller(7)
+    second = cloud()
+    run_controller(7)
+    assert first.bodies and second.bodies == first.bodies
+
+
+def test_controllers_keep_their_own_mirror(cloud):
+    cloud()
+    shared = scenario.state_mirror
+    shared_state = shared.state
+    mirrors = [run_controller(seed, ops=5) for seed in (1, 2)]
+    assert mirrors[0] is not mirrors[1]
+    assert all(m.state is not None for m in mirrors)
+    assert scenario.state_mirror is shared and shared.state is shared_state
@@ -0,0 +1,13 @@
+import os
+
+from conftest import ROOT
+
+
+def code(path):
+    # everything but comment lines
+    with open(os.path.join(ROOT, path)) as f:
+        return [line for line in f if not line.lstrip().startswith("#")]
+
+
+def test_bulb_metrics_is_a_copy_of_cloud_metrics():
+    assert code("Bulb/metrics.py") == code("Cloud/metrics.py")
@@ -0,0 +1,28 @@
+import pytest
+
+import bulb
+import scenario
+from simulate import StandIn
+
+
+@pytest.mark.parametrize("target", ["stand_in", "bulb"])
+@pytest.mark.parametrize("payload", [
+    {"color": "#FFFFFF"},
+    {"enabled": True, "brightness": 100, "color": "#FF0000"},
+    {"enabled": False, "brightness": 40},
+])
+def test_own_write_leaves_no_version_gap(target, payload):
+    # the stand-in must version writes like the real bulb, or the simulation re-reads for nothing
+    if target == "stand_in":
+        stand_in = StandIn(scenario.VirtualClock())
+        status, write = stand_in.status, stand_in.apply
+    else:
+        real = bulb.SmartBulb()
+        status, write = real.status, lambda fields: real.apply_state(**fields)
+    mirror = scenario.StateMirror(ttl=30)
+    mirror.update(status())
+    write(payload)
+    assert mirror.record_write(payload, status()) is False
+    # and again: nothing changes the second time
+    write(payload)
+    assert mirror.record_write(payload, status()) is False
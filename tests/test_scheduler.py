@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+
+from scheduler import Job, Scheduler
+
+
+def run_for(scheduler, seconds):
+    async def main():
+        try:
+            await asyncio.wait_for(scheduler.run(), seconds)
+        except asyncio.TimeoutError:
+            pass
+    asyncio.run(main())
+
+
+def gaps(times):
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def test_backoff_doubles_up_to_the_cap():
+    job = Job("heartbeat", lambda: None, interval=1.0, backoff_max=5.0)
+    delays = []
+    for failures in range(1, 5):
+        job.consecutive_failures = failures
+        delays.append(job.backoff())
+    assert delays == [2.0, 4.0, 5.0, 5.0]
+
+
+def test_failing_job_backs_off_then_resumes_its_interval():
+    starts = []
+
+    def flaky():
+        starts.append(time.monotonic())
+        if len(starts) in (2, 3):
+            raise OSError("network unreachable")
+
+    job = Job("heartbeat", flaky, interval=0.05, jitter=0.0, blocking=False)
+    scheduler = Scheduler()
+    scheduler.add(job)
+    run_for(scheduler, 0.5)
+
+    assert job.failures == 2 and job.consecutive_failures == 0
+    assert job.last_error == "OSError: network unreachable"
+    # ok, fail, fail, ok, ok: 1x, 2x, 4x, then 1x the interval again
+    assert gaps(starts)[:4] == pytest.approx([0.05, 0.1, 0.2, 0.05], abs=0.03)
+
+
+def test_job_can_set_its_own_pause():
+    starts = []
+
+    def adaptive():
+        starts.append(time.monotonic())
+        return 0.15
+
+    scheduler = Scheduler()
+    scheduler.add(Job("discovery", adaptive, interval=0.01, jitter=0.0))
+    run_for(scheduler, 0.4)
+    assert len(starts) == 3
+    assert all(g == pytest.approx(0.15, abs=0.03) for g in gaps(starts))
+
+
+def test_blocking_jobs_do_not_hold_up_the_others():
+    quick = []
+    scheduler = Scheduler()
+    scheduler.add(Job("arp", lambda: time.sleep(0.3), interval=1.0, jitter=0.0))
+    scheduler.add(Job("announce", lambda: quick.append(time.monotonic()), interval=0.05, jitter=0.0, blocking=False))
+    run_for(scheduler, 0.3)
+    assert len(quick) >= 4
+
+
+def test_overrun_is_counted_and_the_next_run_starts_at_once():
+    starts = []
+
+    def slow():
+        starts.append(time.monotonic())
+        time.sleep(0.1)
+
+    job = Job("arp", slow, interval=0.05, jitter=0.0, blocking=False)
+    scheduler = Scheduler()
+    scheduler.add(job)
+    run_for(scheduler, 0.35)
+    # every run outlasts the interval: no pause between them, and each one counted
+    assert job.overruns == job.runs >= 3
+    assert gaps(starts) == pytest.approx([0.1] * (len(starts) - 1), abs=0.03)
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def cached(cloud, monkeypatch):
+    cloud_server, bulb = cloud
+    monkeypatch.setattr(cloud_server.status_cache, "ttl", 0.05)
+    monkeypatch.setattr(cloud_server.status_cache, "stale", 0.2)
+    return cloud_server, bulb, cloud_server.app.test_client()
+
+
+def reads(bulb):
+    return bulb.calls.count(("GET", "/status"))
+
+
+def test_hit_within_ttl_does_not_call_the_bulb(cached):
+    cloud_server, bulb, client = cached
+    first = client.get("/cloud")
+    second = client.get("/cloud")
+    assert (first.headers["X-Cache"], second.headers["X-Cache"]) == ("MISS", "HIT")
+    assert second.get_json()["brightness"] == first.get_json()["brightness"]
+    assert reads(bulb) == 1
+
+
+def test_stale_is_served_at_once_and_refreshed_behind(cached):
+    cloud_server, bulb, client = cached
+    client.get("/cloud")
+    bulb.state["brightness"] = 10
+    time.sleep(0.07)
+    stale = client.get("/cloud")
+    assert stale.headers["X-Cache"] == "STALE"
+    assert stale.get_json()["brightness"] == 100
+    for _ in range(50):
+        if reads(bulb) == 2:
+            break
+        time.sleep(0.01)
+    fresh = client.get("/cloud")
+    assert fresh.headers["X-Cache"] == "HIT"
+    assert fresh.get_json()["brightness"] == 10
+    assert reads(bulb) == 2
+
+
+def test_too_old_is_a_miss(cached):
+    cloud_server, bulb, client = cached
+    client.get("/cloud")
+    time.sleep(0.3)
+    assert client.get("/cloud").headers["X-Cache"] == "MISS"
+    assert reads(bulb) == 2
+
+
+def test_write_goes_through_the_cache(cached, monkeypatch):
+    cloud_server, bulb, client = cached
+    monkeypatch.setattr(cloud_server.status_cache, "ttl", 60)
+    client.get("/cloud")
+    assert client.patch("/cloud", json={"brightness": 40}).status_code == 200
+    resp = client.get("/cloud")
+    assert resp.headers["X-Cache"] == "HIT"
+    assert resp.get_json()["brightness"] == 40
+    assert reads(bulb) == 1